@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+'''
+Timing comparisons for the one bit transform band selection on synthetic
+hyperspectral cubes, each stage against the code it replaced:
+
+    python benchmark.py transitions --bands 128 --height 587 --width 696
+    python benchmark.py hamming --bands 128 --height 587 --width 696
+    python benchmark.py filter --bands 128 --height 587 --width 696 --threads 4
+    python benchmark.py live --bands 128 --height 587 --width 696 --frames 20
+'''
+
+__author__ = 'smh'
+__date__ = '2018.10.26'
+
+import argparse
+import itertools
+import time
+import numpy as np
+import cv2
+import model
+
+
+# CHW float32 cube: one smooth scene in every band, under noise of a different
+# strength in each band, so some bands are well-structured and some are not
+def make_synthetic_cube(bands, height, width, seed=0):
+    rng = np.random.RandomState(seed)
+    scene = cv2.GaussianBlur(rng.rand(height, width).astype(np.float32), (0, 0), 4)
+    scene = (scene - scene.min()) / (scene.max() - scene.min() + model.eps)
+    noise = rng.rand(bands) ** 2
+    cube = np.empty(shape=(bands, height, width), dtype=np.float32)
+    for b in range(bands):
+        cube[b] = 3000 * scene + 3000 * noise[b] * rng.rand(height, width)
+    return cube
+
+
+# the 1-bit transform of one band that _onebit_transform_cube replaced: the full
+# 17x17 multibandpass kernel through filter2D, then packed
+def _onebit_band_reference(band, filter_kernel):
+    filtered = cv2.filter2D(src=band, ddepth=cv2.CV_32FC1,  kernel=filter_kernel)
+    return np.packbits(band > filtered, axis=-1)
+
+
+# the separable comb filter over the whole cube, against filter2D band by band,
+# on float32 and on uint16 bands
+def bench_filter(bands, height, width, n_threads=1):
+    filter_kernel = model._generate_multibandpass_filter()
+    print('1-bit transform (%d x %d x %d, %d thread(s))' % (bands, height, width, n_threads))
+    for dtype in (np.float32, np.uint16):
+        cube = make_synthetic_cube(bands, height, width).astype(dtype)
+
+        start = time.time()
+        ref = np.array([_onebit_band_reference(band, filter_kernel) for band in cube])
+        ref_time = time.time() - start
+
+        start = time.time()
+        out = model._onebit_transform_cube(cube, n_threads)
+        new_time = time.time() - start
+
+        differ = np.unpackbits(np.bitwise_xor(ref, out)).sum()
+        print('    %-8s filter2D per band %.4fs, combs %.4fs, %.1fx, %d pixels differ'
+              % (np.dtype(dtype).name, ref_time, new_time, ref_time / new_time, differ))
+
+
+# the transition count of one 0/1 band that _numberoftransitions replaced
+def _band_transition_reference(band):
+    count_h = 0
+    count_w = 0
+    H, W = band.shape
+    # calculate the transition number along the row
+    for i in range(H-1):
+        for j in range(W-1):
+            count_h += np.bitwise_xor(band[i][j], band[i][j+1])
+    # calculate the transition number along the column
+    for i in range(W):
+        for j in range(H-1):
+            count_w += np.bitwise_xor(band[j][i], band[j+1][i])
+    return count_h + count_w
+
+
+# packed xor/popcount transition counts of every band at once, against the
+# python loops over max_reference bands (extrapolated to all bands)
+def bench_transitions(bands, height, width, max_reference=2):
+    obt_img = model._onebittransform(make_synthetic_cube(bands, height, width))
+
+    start = time.time()
+    counts = model._numberoftransitions(obt_img, width)
+    new_time = time.time() - start
+
+    n_ref = min(max_reference, bands)
+    start = time.time()
+    ref = [_band_transition_reference(model._unpack_bands(band, width).astype(int)) for band in obt_img[:n_ref]]
+    ref_time = (time.time() - start) * bands / max(n_ref, 1)
+    assert (counts[:n_ref] == ref).all(), 'transition counts differ'
+
+    print('transition count (%d x %d x %d)' % (bands, height, width))
+    print('    python loops, float64 bands: %9.4fs  %7.1f MB  (%d bands timed)'
+          % (ref_time, bands * height * width * 8 / 2.0 ** 20, n_ref))
+    print('    xor/popcount, packed bands:  %9.4fs  %7.1f MB' % (new_time, obt_img.nbytes / 2.0 ** 20))
+    print('    speedup:                     %.0fx' % (ref_time / new_time))
+
+
+# the band pair search that the hamming matrix replaced: a popcount for every
+# ordered pair of well-structured bands
+def _correlation_bands_reference(idx, bands):
+    least_similar_bands = (0, 1)
+    currMaxCorr = 0
+    for index in itertools.product(idx[0], idx[0]):
+        id_1 = index[0]
+        id_2 = index[1]
+        if id_1 <= id_2:
+            continue
+        correlations = model._calculate_band_correlations(bands[id_1], bands[id_2])
+        if correlations > currMaxCorr:
+            currMaxCorr = correlations
+            least_similar_bands = index
+
+    return least_similar_bands
+
+
+# the third band search that the hamming matrix replaced
+def _third_band_reference(lsb, idx, bands):
+    currMaxCorr = 0
+    currMaxRatio = 0
+    currIdx = idx[0][0]
+    id_1, id_2 = lsb
+    for index in idx[0]:
+        if index == id_1 or index == id_2:
+            continue
+        corr1 = model._calculate_band_correlations(bands[index], bands[id_1])
+        corr2 = model._calculate_band_correlations(bands[index], bands[id_2])
+        corr = corr1 + corr2
+        if corr1 > corr2:
+            corrRatio = corr2 / (corr1 + model.eps)
+        else:
+            corrRatio = corr1 / (corr2 + model.eps)
+        if currMaxCorr < corr or (currMaxCorr == corr and corrRatio > currMaxRatio):
+            currIdx = index
+            currMaxCorr = corr
+            currMaxRatio = corrRatio
+
+    return currIdx
+
+
+# band selection from one hamming matrix of all bands, against a popcount per
+# pair, both on the same packed one-bit cube, best of repeat runs after one
+# untimed run of each (the first call of some numpy functions costs ~10ms)
+def bench_hamming(bands, height, width, repeat=5):
+    obt_img = model._onebittransform(make_synthetic_cube(bands, height, width))
+    trans_lst = model._numberoftransitions(obt_img, width)
+    idx = np.where(model._calculate_local_threshold(trans_lst, 7) * 0.95 > trans_lst)
+
+    def reference():
+        lsb = _correlation_bands_reference(idx, obt_img)
+        return lsb, _third_band_reference(lsb, idx, obt_img)
+
+    def matrix():
+        dist = model._hamming_matrix(obt_img, width, np.union1d(idx[0], (0, 1)))
+        lsb = model._calculate_correlation_bands(idx, dist)
+        return lsb, model._calculate_third_band(lsb, idx, dist)
+
+    timings = []
+    for run in (reference, matrix):
+        run()
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.time()
+            run()
+            best = min(best, time.time() - start)
+        timings.append(best)
+    ref_time, new_time = timings
+    lsb, third = reference()
+    new_lsb, new_third = matrix()
+    assert tuple(new_lsb) == tuple(lsb) and new_third == third, 'selected bands differ'
+
+    print('band selection (%d x %d x %d, %d well-structured bands)' % (bands, height, width, len(idx[0])))
+    print('    popcount per pair:  %.4fs' % ref_time)
+    print('    hamming matrix:     %.4fs' % new_time)
+    print('    speedup:            %.1fx' % (ref_time / new_time))
+    print('    bands:              %d, %d, %d' % (lsb[0], lsb[1], third))
+
+
+# frames/s of a live display of n_frames noisy frames of a scene that changes
+# halfway, selecting the bands on every frame against PseudoColourRenderer
+def bench_live(bands, height, width, n_frames=20, threshold=0.1, n_threads=1):
+    scenes = [make_synthetic_cube(bands, height, width, seed=0), make_synthetic_cube(bands, height, width, seed=1)]
+    rng = np.random.RandomState(0)
+
+    def frame(f):
+        noise = 0.02 * 3000 * rng.rand(height, width).astype(np.float32)
+        return scenes[2 * f // n_frames] + noise
+
+    renderer = model.PseudoColourRenderer(threshold, n_threads=n_threads)
+    frame_time = 0
+    full_time = 0
+    agree = 0
+    for f in range(n_frames):
+        cube = frame(f)
+        start = time.time()
+        img = renderer.render(cube)
+        frame_time += time.time() - start
+
+        start = time.time()
+        full = model.select_pseudo_bands(cube, n_threads)
+        full_time += time.time() - start
+        agree += tuple(full) == tuple(renderer.channels)
+
+    print('live pseudo-color (%d frames of %d x %d x %d, scene change at frame %d)'
+          % (n_frames, bands, height, width, n_frames // 2))
+    print('    selection every frame:  %6.1f frames/s' % (n_frames / full_time))
+    print('    PseudoColourRenderer:   %6.1f frames/s, %d selections' % (n_frames / frame_time, renderer.selections))
+    print('    same bands as a full selection on %d of %d frames' % (agree, n_frames))
+
+
+if __name__ == '__main__':
+    parse = argparse.ArgumentParser()
+    parse.add_argument('stage', choices=['transitions', 'hamming', 'filter', 'live'])
+    parse.add_argument('--bands', type=int, default=128)
+    parse.add_argument('--height', type=int, default=587)
+    parse.add_argument('--width', type=int, default=696)
+    parse.add_argument('--threads', type=int, default=1)
+    parse.add_argument('--frames', type=int, default=20, help='live: frames shown')
+    parse.add_argument('--threshold', type=float, default=0.1, help='live: drift that re-runs the band selection')
+    parse.add_argument('--max_reference', type=int, default=2, help='bands timed with the replaced code')
+    args = parse.parse_args()
+
+    if args.stage == 'transitions':
+        bench_transitions(args.bands, args.height, args.width, args.max_reference)
+    elif args.stage == 'hamming':
+        bench_hamming(args.bands, args.height, args.width)
+    elif args.stage == 'filter':
+        bench_filter(args.bands, args.height, args.width, args.threads)
+    elif args.stage == 'live':
+        bench_live(args.bands, args.height, args.width, args.frames, args.threshold, args.threads)
@@ -3,32 +3,55 @@
 __author__ = 'smh'
 __date__ = '2018.08.22'
 
-import numpy as np
+import argparse
+import os
+import sys
+import time
+# envi lives in SSforHS
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SSforHS'))
+
 import model
 import cv2
+import envi
 
 dir = '/home/smher/Documents/Hyperspectrals/20180822/hs_img_datas_0001.raw'
 
 
-def read_raw_data(file_name, samples, lines, bands):
-    fd = open(file_name, 'rb')
-    rows = lines
-    cols =  samples * bands
-    bin_img = np.fromfile(fd, dtype=np.uint16, count=rows * cols)
-    fd.close()
-    bin_img = np.reshape(bin_img, newshape=(rows, bands, -1))
-    img = np.transpose(bin_img, axes=(1, 0, 2))
-    return img
+# (bands, lines, samples) memmap view of a raw file, layout from its .hdr
+# where not given (the camera's 696 x 587 x 128 BIL without one), see SSforHS/envi
+def read_raw_data(file_name, samples=None, lines=None, bands=None, interleave=None):
+    return envi.open_cube(file_name, samples, lines, bands, interleave,
+                          defaults={'samples': 696, 'lines': 587, 'bands': 128, 'interleave': 'bil'})
 
 
-if __name__ == '__main__':
-    rgb = read_raw_data(dir, samples=696, lines=587, bands=128)
-    rgb = np.float32(rgb)
-    img = model.show_hyper_img_top(rgb)
-    img = img.astype('float32')
-    img = img / np.max(img)
-    cv2.imshow('Test', img)
+# show the raw cubes file_names one after the other as a live display of one
+# scene, the bands only selected again when the scene has changed (see
+# model.PseudoColourRenderer)
+def show_live(file_names, threshold=0.1, samples=None, lines=None, bands=None, interleave=None):
+    renderer = model.PseudoColourRenderer(threshold, n_threads=os.cpu_count() or 1)
+    start = time.time()
+    for file_name in file_names:
+        cube = read_raw_data(file_name, samples, lines, bands, interleave)
+        # the selection reads a few bands at a time, the image only the three
+        # selected
+        img = envi.rgb_preview(cube, renderer.select(cube))
+        cv2.imshow('Test', img)
+        cv2.waitKey(1)
+    print('%d frames, %d band selections, %.1f frames/s' % (
+        renderer.frames, renderer.selections, renderer.frames / (time.time() - start)))
     cv2.waitKey()
+
+
+if __name__ == '__main__':
+    parse = argparse.ArgumentParser()
+    parse.add_argument('files', type=str, nargs='*', default=[dir], help='raw cubes, shown in this order')
+    parse.add_argument('--threshold', type=float, default=0.1, help='drift that re-runs the band selection')
+    parse.add_argument('--samples', type=int, default=None, help='default: from the .hdr')
+    parse.add_argument('--lines', type=int, default=None, help='default: from the .hdr')
+    parse.add_argument('--bands', type=int, default=None, help='default: from the .hdr')
+    args = parse.parse_args()
+
+    show_live(args.files, args.threshold, args.samples, args.lines, args.bands)
     '''
     fd = open(dir, 'rb')
     rows = 587
@@ -13,12 +13,22 @@ __date__ = '2018.08.22'
 
 import numpy as np
 import itertools
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import joblib
 
 
 eps = 1e-6
 
+# 1-bit bands are stored packed along the width, 8 pixels a byte (np.packbits,
+# first pixel in the high bit), so a CHW one-bit cube is (C, H, (W + 7) // 8) uint8
+# number of set bits of each byte value
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, np.newaxis], axis=1).sum(axis=1).astype(np.uint8)
+
+# the multibandpass kernel is the outer product of two 5 tap combs, 4 pixels
+# apart: offsets of the taps from the centre along each axis
+_COMB = (-8, -4, 0, 4, 8)
+
 
 def _generate_multibandpass_filter(shape=(17, 17)):
     if len(shape) != 2:
@@ -30,29 +40,51 @@ def _generate_multibandpass_filter(shape=(17, 17)):
     return filter_kernel
 
 
-# img is a single band image
-def _onebit_transform_band(img, filter_kernel):
-    filtered = cv2.filter2D(src=img, ddepth=cv2.CV_32FC1,  kernel=filter_kernel)
-    idx = np.where(img > filtered)
-    onebit_piexl = np.zeros(img.shape)
-    onebit_piexl[idx] = 1
-
-    return onebit_piexl
-
-
-def _calculate_band_transition(band):
-    count_h = 0
-    count_w = 0
-    H, W = band.shape
-    # calculate the transition number along the row
-    for i in range(H-1):
-        for j in range(W-1):
-            count_h += np.bitwise_xor(band[i][j], band[i][j+1])
-    # calculate the transition number along the column
-    for i in range(W):
-        for j in range(H-1):
-            count_w += np.bitwise_xor(band[j][i], band[j+1][i])
-    return count_h + count_w
+# 1-bit transform of every band of the CHW cube img at once, returns the packed
+# one-bit cube. The multibandpass filter is applied as two combs, each a sum of
+# 5 shifted views of the (reflect 101 padded, like filter2D) band, splitting
+# the bands over n_threads threads. Integer bands are compared exactly,
+# 25 * pixel > sum of the 25 taps, float bands in their own precision.
+def _onebit_transform_cube(img, n_threads=1):
+    n, h, w = img.shape
+    integer = np.issubdtype(img.dtype, np.integer)
+    if integer:
+        acc_dtype = np.dtype(np.int32 if img.dtype.itemsize <= 2 else np.int64)
+    else:
+        acc_dtype = np.result_type(img.dtype, np.float32)
+    taps = len(_COMB) ** 2
+    r = max(_COMB)
+    output = np.empty(shape=(n, h, (w + 7) // 8), dtype=np.uint8)
+
+    def transform_chunk(band_idx):
+        # one band at a time so the temporaries stay in cache
+        for b in band_idx:
+            band = np.asarray(img[b], dtype=acc_dtype)
+            padded = np.pad(band, r, mode='reflect')
+            rows = padded[r + _COMB[0]:r + _COMB[0] + h].copy()
+            for o in _COMB[1:]:
+                rows += padded[r + o:r + o + h]
+            filtered = rows[:, r + _COMB[0]:r + _COMB[0] + w].copy()
+            for o in _COMB[1:]:
+                filtered += rows[:, r + o:r + o + w]
+            if integer:
+                output[b] = np.packbits(band * taps > filtered, axis=-1)
+            else:
+                output[b] = np.packbits(band > filtered / acc_dtype.type(taps), axis=-1)
+
+    chunks = [c for c in np.array_split(np.arange(n), max(n_threads, 1)) if len(c)]
+    if len(chunks) == 1:
+        transform_chunk(chunks[0])
+    else:
+        # numpy releases the GIL in the element-wise kernels above
+        with ThreadPoolExecutor(max_workers=len(chunks)) as pool:
+            list(pool.map(transform_chunk, chunks))
+    return output
+
+
+# packed 1-bit bands back to 0/1, (..., H, width) float64
+def _unpack_bands(bands, width):
+    return np.unpackbits(bands, axis=-1, count=width).astype(np.float64)
 
 
 def _one_dimension_boxfilter(img, wid_size):
@@ -86,35 +118,39 @@ def _one_dimension_boxfilter(img, wid_size):
 
 
 # 等价于：计算band1与band2的对应位置的数值进行xor然后加和,因为band1和band2的元素要么为0要么为1
+# band1, band2 are packed, so it is the popcount of their xor
 def _calculate_band_correlations(band1, band2):
-    return np.sum(np.abs(band1-band2))
+    return _POPCOUNT[np.bitwise_xor(band1, band2)].sum(dtype=np.int64)
 
 
 # Step 1.1: get the One-Bit representation of image frames.
-# calculate 1-bit transform for each band
-def _onebittransform(img):
+# calculate 1-bit transform for each band, returns the packed one-bit cube
+def _onebittransform(img, n_threads=1):
     if len(img.shape) != 3:
         raise ValueError('Shape mismatch(1bt). Input img must have more than one band. Data layout: CHW')
-    filter_kernel = _generate_multibandpass_filter()
-    obt_lst = []
-    for band in img:
-        band = _onebit_transform_band(band, filter_kernel)
-        obt_lst.append(band)
-
-    return np.array(obt_lst)
+    return _onebit_transform_cube(img, n_threads)
 
 
 # Step 1.2: count the total number of transitions in the horizontal and vertical directions of each band
-def _numberoftransitions(img):
+# img is the packed one-bit cube of bands `width` pixels wide. All bands are
+# counted at once: a transition is a set bit of the xor of the bands with
+# themselves shifted by one pixel. As always, the last row has no horizontal
+# transitions counted.
+def _numberoftransitions(img, width):
     if len(img.shape) != 3:
         raise ValueError('Shape mismatch(transition count). Input img must have more than one band. Data layout: CHW')
-    #print('shape of img step1.2: ', img.shape)
-    transition_count_lst = []
-    for band in img:
-        band = band.astype(int)
-        transition_count_lst.append(_calculate_band_transition(band))
+    # along the row: shift each row left by one bit, carrying the high bit of
+    # the next byte, so every pixel lines up with its right neighbour
+    carry = np.zeros_like(img)
+    carry[:, :, :-1] = img[:, :, 1:] >> 7
+    row_xor = np.bitwise_xor(img, (img << 1) | carry)
+    # only pixels 0 .. width - 2 have a right neighbour
+    valid = np.packbits(np.arange(img.shape[2] * 8) < width - 1)
+    count_h = _POPCOUNT[row_xor[:, :-1] & valid].sum(axis=(1, 2), dtype=np.int64)
+    # along the column, the padding bits are 0 in both rows
+    count_w = _POPCOUNT[np.bitwise_xor(img[:, :-1], img[:, 1:])].sum(axis=(1, 2), dtype=np.int64)
 
-    return np.array(transition_count_lst)
+    return count_h + count_w
 
 
 # Step 1.3: calculate the local threshold, i.e. the meaning value within wid_size
@@ -126,97 +162,118 @@ def _calculate_local_threshold(trans, wid_size):
 
 
 # Step 1: Obtaining Well-Structured Image Bands Using 1BT
-def calculate_well_structured(img, filter_shape=(17, 17), wid_size=7, a=0.95):
-    obt_img = _onebittransform(img)
-    trans_lst = _numberoftransitions(obt_img)
+# returns the indices of the well-structured bands and the packed one-bit cube
+# dump: save the transitions and the local thresholds, as trans_lst.joblib and
+# local_thsh.joblib (see trans_test.py)
+def calculate_well_structured(img, filter_shape=(17, 17), wid_size=7, a=0.95, n_threads=1, dump=False):
+    obt_img = _onebittransform(img, n_threads)
+    trans_lst = _numberoftransitions(obt_img, img.shape[2])
     local_thsh = _calculate_local_threshold(trans_lst, wid_size)
     idx = np.where(local_thsh * a > trans_lst)
-    joblib.dump(trans_lst, 'trans_lst.joblib')
-    joblib.dump(local_thsh, 'local_thsh.joblib')
+    if dump:
+        joblib.dump(trans_lst, 'trans_lst.joblib')
+        joblib.dump(local_thsh, 'local_thsh.joblib')
 
     return idx, obt_img
 
 
+# Hamming distance between every two bands of the packed one-bit cube of bands
+# `width` pixels wide, (C, C) int64. With subset, only between the bands of
+# subset, the other entries are 0.
+# |a xor b| = |a| + |b| - 2 |a and b|, and |a and b| of all pairs at once is
+# the product of the unpacked bands with themselves, taken block_pixels at a
+# time so that float32 counts them exactly. Below pairwise_below bands of subset
+# a popcount per pair is cheaper (break-even near 8 bands of 587 x 696 pixels,
+# near 5 of 60 x 77).
+def _hamming_matrix(bands, width, subset=None, block_pixels=1 << 15, pairwise_below=8):
+    n, h = bands.shape[:2]
+    subset = np.arange(n) if subset is None else np.asarray(subset)
+    if len(subset) < pairwise_below:
+        dist = np.zeros(shape=(n, n), dtype=np.int64)
+        for id_1, id_2 in itertools.combinations(subset, 2):
+            dist[id_1, id_2] = dist[id_2, id_1] = _calculate_band_correlations(bands[id_1], bands[id_2])
+        return dist
+    rows = max(1, block_pixels // width)
+    common = np.zeros(shape=(len(subset), len(subset)), dtype=np.int64)
+    for y in range(0, h, rows):
+        block = np.unpackbits(bands[subset, y:y + rows], axis=-1, count=width).reshape(len(subset), -1)
+        block = block.astype(np.float32)
+        common += np.dot(block, block.T).astype(np.int64)
+    ones = np.diag(common)
+    dist = np.zeros(shape=(n, n), dtype=np.int64)
+    dist[np.ix_(subset, subset)] = ones[:, np.newaxis] + ones[np.newaxis, :] - 2 * common
+    return dist
+
+
 # Step 2.1 calculate the correlation for each well-structured band
-# calculate the first two bands
-def _calculate_correlation_bands(idx, bands):
-    n, h, w = bands.shape
+# calculate the first two bands: the most distant pair (id_1, id_2), id_1 > id_2,
+# the first in the order of id_1 then id_2 on ties, (0, 1) if all are equal
+# dist is the hamming matrix of all bands
+def _calculate_correlation_bands(idx, dist):
+    n = dist.shape[0]
     if n < 3:
         raise ValueError('Shape mismatch(select bands). Input bands should be more than three.')
-    least_similar_bands = (0, 1)
-    currMaxCorr = 0
-    for index in itertools.product(idx[0], idx[0]):
-        id_1 = index[0]
-        id_2 = index[1]
-        if id_1 <= id_2:
-            continue
-        correlations = _calculate_band_correlations(bands[id_1], bands[id_2])
-        if correlations > currMaxCorr:
-            currMaxCorr = correlations
-            least_similar_bands = index
-
-    return least_similar_bands
-
-
-def _calculate_third_band(lsb, idx, bands):
-    currMaxCorr = 0
-    currMaxRatio = 0
-    currIdx = idx[0][0]
+    lower = np.tril(dist[np.ix_(idx[0], idx[0])], k=-1)
+    if lower.size == 0 or lower.max() <= 0:
+        return 0, 1
+    id_1, id_2 = np.unravel_index(np.argmax(lower), lower.shape)
+
+    return idx[0][id_1], idx[0][id_2]
+
+
+# the band most distant from both of lsb, the most even of those on ties,
+# idx[0][0] if none is distant from them
+def _calculate_third_band(lsb, idx, dist):
     id_1, id_2 = lsb
-    for index in idx[0]:
-        if index == id_1 or index == id_2:
-            continue
-        corr1 = _calculate_band_correlations(bands[index], bands[id_1])
-        corr2 = _calculate_band_correlations(bands[index], bands[id_2])
-        corr = corr1 + corr2
-        if corr1 > corr2:
-            corrRatio = corr2 / (corr1 + eps)
-        else:
-            corrRatio = corr1 / (corr2 + eps)
-        if currMaxCorr < corr:
-            currIdx = index
-            currMaxCorr = corr
-            currMaxRatio = corrRatio
-        elif currMaxCorr == corr:
-            if corrRatio > currMaxRatio:
-                currIdx = index
-                currMaxRatio = corrRatio
-            else:
-                continue
-        else:
-            continue
+    candidates = idx[0][(idx[0] != id_1) & (idx[0] != id_2)]
+    corr1 = dist[candidates, id_1]
+    corr2 = dist[candidates, id_2]
+    corr = corr1 + corr2
+    if len(candidates) == 0 or corr.max() <= 0:
+        return idx[0][0]
+    corrRatio = np.where(corr1 > corr2, corr2 / (corr1 + eps), corr1 / (corr2 + eps))
+    corrRatio[corr != corr.max()] = -1
 
-    return currIdx
+    return candidates[np.argmax(corrRatio)]
 
 
 # Step 2: selecting three suitable bands for the color display
-def calculate_rgb(idx, bands, img):
+# bands is the packed one-bit cube of bands `width` pixels wide
+# returns the indices of the r, g and b bands
+def select_rgb_bands(idx, bands, width):
     print('shape of bands: ', bands.shape)
-    id0, id1 = _calculate_correlation_bands(idx, bands)
-    id2 = _calculate_third_band((id0, id1), idx, bands)
-    var0 = np.std(bands[id0])
-    var1 = np.std(bands[id1])
-    var2 = np.std(bands[id2])
-    var_dict = dict()
-    var_dict[var0] = id0
-    var_dict[var1] = id1
-    var_dict[var2] = id2
-    sorted_keys = sorted(var_dict.keys())   # Increment order
-    r = img[var_dict[sorted_keys[2]]]
-    g = img[var_dict[sorted_keys[1]]]
-    b = img[var_dict[sorted_keys[0]]]
-
-    return r, g, b
+    # the pair falls back to (0, 1), which need not be well-structured
+    dist = _hamming_matrix(bands, width, np.union1d(idx[0], (0, 1)))
+    id0, id1 = _calculate_correlation_bands(idx, dist)
+    id2 = _calculate_third_band((id0, id1), idx, dist)
+    # (std, band) pairs, so that bands of equal std are all kept
+    var_lst = sorted((np.std(_unpack_bands(bands[i], width)), i) for i in (id0, id1, id2))   # Increment order
+
+    return var_lst[2][1], var_lst[1][1], var_lst[0][1]
+
+
+def calculate_rgb(idx, bands, img):
+    r, g, b = select_rgb_bands(idx, bands, img.shape[2])
+    return img[r], img[g], img[b]
+
+
+## @func Band selection of the top function
+## @param img: the input hyperspectral matrix, CHW
+## @param n_threads: threads of the 1-bit transform
+## @return the indices of the bands of the pseudo-color image, in its channel order
+def select_pseudo_bands(img, n_threads=1):
+    # Step 1:
+    idx, bands = calculate_well_structured(img, n_threads=n_threads)
+    r, b, g = select_rgb_bands(idx, bands, img.shape[2])
+    return b, g, r
 
 
 ## @func Top function
 ## @param img: the input hyperspectral matrix
+## @param n_threads: threads of the 1-bit transform
 ## @return pseudo_img: the return pseudo-color image of input hyperspectral matrix
-def show_hyper_img_top(img, show_img=False):
-    # Step 1:
-    idx, bands = calculate_well_structured(img)
-    r, b, g = calculate_rgb(idx, bands, img)
-    pseudo_img = np.array([b, g, r])
+def show_hyper_img_top(img, show_img=False, n_threads=1):
+    pseudo_img = np.array(img[list(select_pseudo_bands(img, n_threads))])
     pseudo_img = np.transpose(pseudo_img, axes=(1, 2, 0))
     if show_img:
         cv2.imshow('Pseudo-color', pseudo_img)
@@ -225,6 +282,49 @@ def show_hyper_img_top(img, show_img=False):
     return pseudo_img
 
 
+## @class Live pseudo-color display over consecutive frames of one scene
+## The bands are selected once and kept from frame to frame; the selection is
+## only re-run when the transitions of the bands, counted on a grid of every
+## step-th pixel, have drifted by more than threshold (relative change of the
+## sum) from the frame they were selected on.
+class PseudoColourRenderer(object):
+    def __init__(self, threshold=0.1, step=4, n_threads=1):
+        self.threshold = threshold
+        self.step = step
+        self.n_threads = n_threads
+        # bands of the pseudo-color image, in its channel order, and the grid
+        # transitions of the frame they were selected on
+        self.channels = None
+        self.reference = None
+        self.frames = 0
+        self.selections = 0
+
+    # transitions of each band of img on the grid, per grid pixel
+    def transitions(self, img):
+        grid = img[:, ::self.step, ::self.step]
+        bands = _onebittransform(grid, self.n_threads)
+        return _numberoftransitions(bands, grid.shape[2]) / float(grid.shape[1] * grid.shape[2])
+
+    # drift of the grid transitions trans from the last selection
+    def _drift(self, trans):
+        return np.sum(np.abs(trans - self.reference)) / max(np.sum(self.reference), eps)
+
+    # the bands of the pseudo-color image of img, in its channel order
+    def select(self, img):
+        trans = self.transitions(img)
+        self.frames += 1
+        if self.channels is None or trans.shape != self.reference.shape or self._drift(trans) > self.threshold:
+            self.channels = select_pseudo_bands(img, self.n_threads)
+            self.reference = trans
+            self.selections += 1
+        return self.channels
+
+    # the pseudo-color image of img, like show_hyper_img_top
+    def render(self, img):
+        pseudo_img = np.array(img[list(self.select(img))])
+        return np.transpose(pseudo_img, axes=(1, 2, 0))
+
+
 if __name__ == '__main__':
     # Under Tested
     pass
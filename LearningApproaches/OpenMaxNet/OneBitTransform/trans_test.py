@@ -1,7 +1,11 @@
+import sys
 import joblib
 import numpy as np
 import model
+import main
 
+# the transitions and local thresholds of the cube given (main's by default)
+model.calculate_well_structured(main.read_raw_data(sys.argv[1] if len(sys.argv) > 1 else main.dir), dump=True)
 trans = joblib.load('trans_lst.joblib')
 thresh = joblib.load('local_thsh.joblib')
 
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+'''
+Project a hyperspectral cube onto a few components before segmentation.
+
+The edge weights of graphSeg are built from band-wise dot products, so every
+projection here is scaled to preserve dot products:
+    pca:    principal axes of the (uncentered) band second-moment matrix
+    random: gaussian random projection
+    bin:    contiguous band bins, each bin mean scaled by sqrt(bin width)
+'''
+
+__author__ = 'smh'
+__date__ = '2018.09.27'
+
+import numpy as np
+
+
+# Returns a (n_components, bands) projection matrix for cube (bands, height, width).
+# pca only looks at every sample_step-th pixel along each axis.
+def fit_projection(cube, n_components, method='pca', seed=0, sample_step=4):
+    bands = cube.shape[0]
+    if not 0 < n_components <= bands:
+        raise ValueError('n_components must be in [1, %d], got %d' % (bands, n_components))
+
+    if method == 'pca':
+        samples = np.asarray(cube[:, ::sample_step, ::sample_step], dtype=np.float64)
+        samples = samples.reshape(bands, -1)
+        moments = np.dot(samples, samples.T) / samples.shape[1]
+        eig_vals, eig_vecs = np.linalg.eigh(moments)
+        matrix = eig_vecs[:, ::-1][:, :n_components].T
+    elif method == 'random':
+        rng = np.random.RandomState(seed)
+        matrix = rng.normal(size=(n_components, bands)) / np.sqrt(n_components)
+    elif method == 'bin':
+        matrix = np.zeros(shape=(n_components, bands))
+        for i, idx in enumerate(np.array_split(np.arange(bands), n_components)):
+            matrix[i, idx] = 1.0 / np.sqrt(len(idx))
+    else:
+        raise ValueError('Unknown projection method: %s' % method)
+
+    return matrix.astype(np.float32)
+
+
+# Returns matrix applied to every pixel of cube, (n_components, height, width) float32.
+# Works through the cube a block of rows at a time so it can be an np.memmap.
+def project_bands(cube, matrix, block=64):
+    bands, height, width = cube.shape
+    output = np.empty(shape=(matrix.shape[0], height, width), dtype=np.float32)
+    for y in range(0, height, block):
+        rows = np.asarray(cube[:, y:y + block], dtype=np.float32)
+        output[:, y:y + block] = np.tensordot(matrix, rows, axes=(1, 0))
+    return output
+
+
+# adjusted Rand index between two label maps: 1.0 for the same partition,
+# around 0.0 for unrelated ones
+def label_agreement(labels_a, labels_b):
+    _, a = np.unique(labels_a, return_inverse=True)
+    _, b = np.unique(labels_b, return_inverse=True)
+    a = a.ravel().astype(np.int64)
+    b = b.ravel().astype(np.int64)
+    n = len(a)
+
+    def pairs(counts):
+        counts = counts.astype(np.float64)
+        return np.sum(counts * (counts - 1) / 2.0)
+
+    _, joint = np.unique(a * (b.max() + 1) + b, return_counts=True)
+    sum_joint = pairs(joint)
+    sum_a = pairs(np.bincount(a))
+    sum_b = pairs(np.bincount(b))
+    expected = sum_a * sum_b / (n * (n - 1) / 2.0)
+    maximum = (sum_a + sum_b) / 2.0
+    if maximum == expected:
+        return 1.0
+    return (sum_joint - expected) / (maximum - expected)
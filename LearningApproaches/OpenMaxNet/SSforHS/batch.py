@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+'''
+Selective search over every image of a directory, in a pool of processes.
+
+Images (.png, .bmp, .jpg) go through ssModule, raw hyperspectral cubes (.raw)
+through ss_module. The proposals of each file are cached as
+    <cache>/<key>.npz    (proposals (N, 5) float32 and sizes (N,), see proposals)
+where key is the sha1 of the file content and (scale, sigma, min_size), and
+of the layout a raw cube is read with (from its .hdr, see envi), so
+re-running with unchanged files and parameters only reads the cache. A file
+that cannot be searched is logged and reported with the others, the rest of
+the batch goes on:
+
+    python batch.py /data/hs_imgs --scale 500 --sigma 0.9 --min_size 10 --workers 8
+'''
+
+__author__ = 'smh'
+__date__ = '2018.10.20'
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import hashlib
+import multiprocessing
+import os
+import time
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.png', '.bmp', '.jpg')
+RAW_EXTENSIONS = ('.raw',)
+
+
+# the images and raw cubes under root, sorted
+def find_inputs(root, recursive=True):
+    extensions = IMAGE_EXTENSIONS + RAW_EXTENSIONS
+    paths = []
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names.sort()
+        for name in sorted(file_names):
+            if name.lower().endswith(extensions):
+                paths.append(os.path.join(dir_path, name))
+        if not recursive:
+            break
+    return paths
+
+
+# sha1 of the content of file_name, read a block at a time
+def file_digest(file_name, block=1 << 20):
+    digest = hashlib.sha1()
+    with open(file_name, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(block), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# (samples, lines, bands, interleave, dtype) raw cube file_name is read with:
+# the entries of raw_shape (samples, lines, bands) that are not None, the rest
+# from its .hdr, or readRaw.SENSOR_LAYOUT without one
+def raw_layout(file_name, raw_shape=None):
+    import envi
+    import readRaw
+    samples, lines, bands = raw_shape or (None, None, None)
+    cube = envi.RawCube(file_name, samples, lines, bands, defaults=readRaw.SENSOR_LAYOUT)
+    return cube.samples, cube.lines, cube.bands, cube.interleave, cube.raw.dtype.str
+
+
+# cache key of the proposals of a file with content digest `digest`;
+# layout (see raw_layout) only for raw cubes
+def cache_key(digest, scale, sigma, min_size, layout=None):
+    params = 'scale=%r,sigma=%r,min_size=%r' % (float(scale), float(sigma), int(min_size))
+    if layout is not None:
+        params += ',layout=%r' % (tuple(layout),)
+    return hashlib.sha1((digest + ':' + params).encode('utf-8')).hexdigest()
+
+
+# path of the cached proposals of file_name in cache_dir
+def cache_path(cache_dir, file_name, scale, sigma, min_size, raw_shape=None):
+    layout = None
+    if file_name.lower().endswith(RAW_EXTENSIONS):
+        layout = raw_layout(file_name, raw_shape)
+    key = cache_key(file_digest(file_name), scale, sigma, min_size, layout)
+    return os.path.join(cache_dir, key + '.npz')
+
+
+# (proposals, sizes) of file_name from cache_dir, None if not cached
+def load_proposals(cache_dir, file_name, scale, sigma, min_size, raw_shape=None):
+    path = cache_path(cache_dir, file_name, scale, sigma, min_size, raw_shape)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        return data['proposals'], data['sizes']
+
+
+# proposals and sizes of selective search on one image or raw cube, a raw
+# cube read with raw_shape as in raw_layout
+def search_file(file_name, scale, sigma, min_size, raw_shape=None):
+    if file_name.lower().endswith(RAW_EXTENSIONS):
+        import graphSeg
+        import readRaw
+        import ss_module
+        samples, lines, bands = raw_shape or (None, None, None)
+        cube = readRaw.read_raw_data(file_name, samples, lines, bands)
+        _, (proposals, sizes) = ss_module.selective_search(cube, scale, sigma, min_size, as_array=True)
+        # the segmentation contexts of one cube are of no use for the next
+        graphSeg.clear_contexts()
+    else:
+        import cv2
+        import ssModule
+        img = cv2.imread(file_name)
+        if img is None:
+            raise IOError('Cannot read image: %s' % file_name)
+        _, (proposals, sizes) = ssModule.selective_search(img, scale, sigma, min_size, as_array=True)
+    return proposals, sizes
+
+
+# worker: the proposals of file_name, from cache_dir or computed and cached.
+# Returns (file_name, number of proposals, from cache, seconds, None).
+def _process_file(file_name, cache_dir, scale, sigma, min_size, raw_shape):
+    start = time.time()
+    path = cache_path(cache_dir, file_name, scale, sigma, min_size, raw_shape)
+    if os.path.exists(path):
+        with np.load(path) as data:
+            return file_name, len(data['sizes']), True, time.time() - start, None
+
+    proposals, sizes = search_file(file_name, scale, sigma, min_size, raw_shape)
+    # write then rename, so a killed run leaves no partial entry behind
+    tmp_path = '%s.%d.tmp.npz' % (path[:-len('.npz')], os.getpid())
+    np.savez(tmp_path, proposals=proposals, sizes=sizes)
+    os.replace(tmp_path, path)
+    return file_name, len(sizes), False, time.time() - start, None
+
+
+# the result of a file that failed with error
+def _failed(file_name, error, elapsed=0.0):
+    return file_name, 0, False, elapsed, error
+
+
+# Selective search on every file of file_names with n_workers processes (all
+# cores by default), caching the proposals in cache_dir.
+# raw_shape: (samples, lines, bands) of the raw cubes, None entries (all by
+# default) from the .hdr of each cube, see raw_layout
+# Returns the (file_name, number of proposals, from cache, seconds, error) of
+# each file, in the order of file_names; error is the exception a file failed
+# with, None if it did not.
+def run_batch(file_names, cache_dir, scale=500, sigma=0.9, min_size=10, n_workers=None,
+              raw_shape=None):
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    args = (cache_dir, scale, sigma, min_size, raw_shape)
+
+    results = {}
+    if n_workers <= 1:
+        for file_name in file_names:
+            start = time.time()
+            try:
+                result = _process_file(file_name, *args)
+            except Exception as error:
+                result = _failed(file_name, error, time.time() - start)
+            results[file_name] = result
+            print(_describe(result))
+    else:
+        # spawned like the workers of graphSeg, numba's threads do not survive a fork
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = {pool.submit(_process_file, file_name, *args): file_name for file_name in file_names}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as error:
+                    result = _failed(futures[future], error)
+                results[result[0]] = result
+                print(_describe(result))
+
+    return [results[file_name] for file_name in file_names]
+
+
+# progress line of one result
+def _describe(result):
+    file_name, n, cached, elapsed, error = result
+    if error is not None:
+        return '%s: failed, %s: %s' % (file_name, type(error).__name__, error)
+    return '%s: %d proposals%s, %.2fs' % (file_name, n, ' (cached)' if cached else '', elapsed)
+
+
+if __name__ == '__main__':
+    parse = argparse.ArgumentParser()
+    parse.add_argument('root', type=str, help='directory of images and raw cubes')
+    parse.add_argument('--cache', type=str, default=None, help='proposal cache, <root>/.ss_cache by default')
+    parse.add_argument('--scale', type=float, default=500)
+    parse.add_argument('--sigma', type=float, default=0.9)
+    parse.add_argument('--min_size', type=int, default=10)
+    parse.add_argument('--workers', type=int, default=None)
+    parse.add_argument('--samples', type=int, default=None, help='raw cubes, default: from the .hdr')
+    parse.add_argument('--lines', type=int, default=None, help='raw cubes, default: from the .hdr')
+    parse.add_argument('--bands', type=int, default=None, help='raw cubes, default: from the .hdr')
+    parse.add_argument('--no_recursive', action='store_true')
+    args = parse.parse_args()
+
+    file_names = find_inputs(args.root, recursive=not args.no_recursive)
+    cache_dir = args.cache or os.path.join(args.root, '.ss_cache')
+    start = time.time()
+    results = run_batch(file_names, cache_dir, args.scale, args.sigma, args.min_size, args.workers,
+                        (args.samples, args.lines, args.bands))
+    print('%d files, %d from cache, %d failed, %.2fs' % (
+        len(results), sum(1 for r in results if r[2]), sum(1 for r in results if r[4] is not None),
+        time.time() - start))
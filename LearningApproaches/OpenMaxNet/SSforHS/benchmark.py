@@ -0,0 +1,469 @@
+# -*- coding: utf-8 -*-
+
+'''
+Timing comparisons for the SSforHS pipeline on synthetic hyperspectral cubes.
+
+The pipeline stage times every step of hyperspectral selective search on its
+own and writes the timings as JSON, which can be compared with an earlier run:
+
+    python benchmark.py pipeline --height 200 --width 240 --output new.json --baseline old.json
+
+The other stages compare one optimization against the code it replaced:
+
+    python benchmark.py graph --height 120 --width 100 --bands 128
+    python benchmark.py smooth --height 587 --width 696 --bands 128 --threads 4
+    python benchmark.py reduce --height 200 --width 240 --bands 128
+    python benchmark.py sweep --height 200 --width 240 --bands 128
+    python benchmark.py grouping --regions 500 2000 10000
+    python benchmark.py texture --height 200 --width 240 --bands 128 --threads 4
+    python benchmark.py unpack --mb 256
+'''
+
+__author__ = 'smh'
+__date__ = '2018.09.25'
+
+import argparse
+import copy
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+import numpy as np
+import skimage.feature
+import graphSeg
+from filter import smooth, smooth_cube
+import band_reduce
+import ss_module
+import grouping
+import region_stats
+import texture
+import readRaw
+from region_table import RegionTable
+from segment_graph import sort_edges, segment_sorted, merge_small_components, component_labels
+
+
+def make_synthetic_cube(height, width, bands, seed=0):
+    rng = np.random.RandomState(seed)
+    return rng.uniform(0, 4096, size=(height, width, bands))
+
+
+# piecewise-constant scene of n_regions voronoi cells, each with a smooth
+# random spectrum, plus sensor noise.  Returns (bands, height, width) float32.
+def make_synthetic_scene(height, width, bands, n_regions=40, noise=20.0, seed=0):
+    rng = np.random.RandomState(seed)
+    centres = rng.uniform(0, 1, size=(n_regions, 2)) * (height, width)
+    yy, xx = np.mgrid[0:height, 0:width]
+    dist = (yy[..., None] - centres[:, 0]) ** 2 + (xx[..., None] - centres[:, 1]) ** 2
+    cells = np.argmin(dist, axis=2)
+
+    # neighbouring bands are strongly correlated, as in real sensors
+    t = np.linspace(0, 1, bands)
+    spectra = np.zeros(shape=(n_regions, bands))
+    for i in range(3):
+        spectra += rng.uniform(200, 1000, size=(n_regions, 1)) * \
+            np.exp(-((t - rng.uniform(0, 1, size=(n_regions, 1))) / 0.3) ** 2)
+
+    cube = spectra[cells].transpose(2, 0, 1) + rng.normal(0, noise, size=(bands, height, width))
+    return np.maximum(cube, 0).astype(np.float32)
+
+
+# vectorized build_graph against the per-pixel reference loop
+def bench_graph(height, width, bands):
+    smooth_bands = make_synthetic_cube(height, width, bands)
+
+    start = time.time()
+    loop_edges = graphSeg.build_graph_loop(smooth_bands)
+    loop_time = time.time() - start
+
+    start = time.time()
+    edges = graphSeg.build_graph(smooth_bands)
+    vec_time = time.time() - start
+
+    # same edge set (the order differs: grouped by direction instead of per pixel)
+    loop_set = sorted(zip(loop_edges[0].tolist(), loop_edges[1].tolist()))
+    vec_set = sorted(zip(edges[0].tolist(), edges[1].tolist()))
+    assert loop_set == vec_set, 'edge sets differ'
+    loop_w = dict(zip(zip(loop_edges[0].tolist(), loop_edges[1].tolist()), loop_edges[2].tolist()))
+    vec_w = dict(zip(zip(edges[0].tolist(), edges[1].tolist()), edges[2].tolist()))
+    max_err = max(abs(loop_w[e] - vec_w[e]) / max(loop_w[e], 1.0) for e in loop_w)
+
+    # the tiles of segment_hs_tiled and their seams make up the same graph
+    tile_size = max(min(height, width) // 3, 2)
+    tiled_edges = graphSeg.tiled_graph_edges(smooth_bands, tile_size)
+    tiled_set = sorted(zip(tiled_edges[0].tolist(), tiled_edges[1].tolist()))
+    assert tiled_set == vec_set, 'tiled edge sets differ'
+
+    print('graph build (%d x %d x %d, %d edges)' % (height, width, bands, len(edges[2])))
+    print('    loop:       %.4fs' % loop_time)
+    print('    vectorized: %.4fs' % vec_time)
+    print('    speedup:    %.1fx' % (loop_time / vec_time))
+    print('    max relative weight error: %.2e' % max_err)
+    print('    %d x %d tiles plus seams: same edges' % (tile_size, tile_size))
+
+
+# smooth_cube against smooth() applied band by band
+def bench_smooth(height, width, bands, sigma=0.5, n_threads=1):
+    cube = np.transpose(make_synthetic_cube(height, width, bands), axes=(2, 0, 1))
+
+    # the per-band loop is far too slow for a full cube, so time it on a few bands
+    n_ref = min(bands, 2)
+    start = time.time()
+    ref = np.array([smooth(band, sigma) for band in cube[:n_ref]])
+    loop_time = (time.time() - start) * bands / n_ref
+
+    start = time.time()
+    out = smooth_cube(cube, sigma, n_threads=n_threads)
+    vec_time = time.time() - start
+
+    max_err = np.max(np.abs(out[:n_ref] - ref) / np.maximum(np.abs(ref), 1.0))
+    print('smoothing (%d x %d x %d, sigma %.2f, %d thread(s))' % (height, width, bands, sigma, n_threads))
+    print('    loop (extrapolated): %.4fs' % loop_time)
+    print('    smooth_cube:         %.4fs' % vec_time)
+    print('    speedup:             %.1fx' % (loop_time / vec_time))
+    print('    max relative error:  %.2e' % max_err)
+
+
+# segment_hs on band_reduce projections against the full-band result
+def bench_reduce(height, width, bands, sigma=0.5, k=500, min_size=50,
+                 n_components=(4, 8, 16, 32), methods=('pca', 'random', 'bin')):
+    cube = make_synthetic_scene(height, width, bands)
+
+    start = time.time()
+    full_labels, full_sizes = graphSeg.segment_hs(cube, sigma, k, min_size)
+    full_time = time.time() - start
+
+    results = []
+    for method in methods:
+        for n in n_components:
+            start = time.time()
+            labels, sizes = graphSeg.segment_hs(cube, sigma, k, min_size, n_components=n, reduction=method)
+            elapsed = time.time() - start
+            results.append((method, n, elapsed, len(sizes),
+                            band_reduce.label_agreement(full_labels, labels)))
+
+    print('band reduction (%d x %d x %d, sigma %.2f, k %d, min_size %d)' % (
+        height, width, bands, sigma, k, min_size))
+    print('    full bands:  %.4fs, %d components' % (full_time, len(full_sizes)))
+    print('    method  k    time      speedup  components  ARI')
+    for method, n, elapsed, n_comps, ari in results:
+        print('    %-7s %-4d %.4fs  %6.1fx  %10d  %.4f' % (
+            method, n, elapsed, full_time / elapsed, n_comps, ari))
+
+
+# segment_hs at several k against one cached SegmentationContext
+def bench_sweep(height, width, bands, sigma=0.5, min_size=50, ks=(100, 200, 300, 500, 1000)):
+    cube = make_synthetic_scene(height, width, bands)
+
+    start = time.time()
+    ref = [graphSeg.segment_hs(cube, sigma, k, min_size) for k in ks]
+    loop_time = time.time() - start
+
+    graphSeg.clear_contexts()
+    start = time.time()
+    # the cube is in memory, so it is hashed once for all k
+    key = graphSeg.cube_key(cube)
+    out = [graphSeg.get_context(cube, sigma, key=key).segment(k, min_size) for k in ks]
+    cached_time = time.time() - start
+
+    assert all((r[0] == o[0]).all() for r, o in zip(ref, out)), 'labels differ'
+    print('multi-scale sweep (%d x %d x %d, k in %s)' % (height, width, bands, list(ks)))
+    print('    segment_hs per k: %.4fs' % loop_time)
+    print('    cached context:   %.4fs' % cached_time)
+    print('    speedup:          %.1fx' % (loop_time / cached_time))
+
+
+# RegionTable of texture-only regions of a voronoi label map with about
+# n_regions cells, as ss_module._extract_region returns it, and their
+# (label, label) neighbours
+def make_synthetic_regions(n_regions, cell=12, seed=0):
+    rng = np.random.RandomState(seed)
+    grid = int(np.ceil(np.sqrt(n_regions)))
+    side = grid * cell
+    # one jittered centre per grid cell, so only the 3 x 3 surrounding cells
+    # can hold the nearest centre of a pixel
+    centres = (np.mgrid[0:grid, 0:grid].transpose(1, 2, 0) + rng.uniform(0, 1, size=(grid, grid, 2))) * cell
+    yy, xx = np.mgrid[0:side, 0:side]
+    gy, gx = yy // cell, xx // cell
+    best = np.full((side, side), np.inf)
+    labels = np.zeros(shape=(side, side), dtype=np.int64)
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            cy = np.clip(gy + dy, 0, grid - 1)
+            cx = np.clip(gx + dx, 0, grid - 1)
+            dist = (yy - centres[cy, cx, 0]) ** 2 + (xx - centres[cy, cx, 1]) ** 2
+            closer = dist < best
+            best[closer] = dist[closer]
+            labels[closer] = (cy * grid + cx)[closer]
+    n_regions = grid * grid
+
+    hist = rng.uniform(0, 1, size=(n_regions, 10 * 16))
+    hist /= hist.sum(axis=1, keepdims=True)
+    cells, ids = region_stats.region_ids(labels)
+    bounds = region_stats.region_bounds(ids, len(cells), side)
+    R = RegionTable(cells, *bounds, hists={'hist_t': hist[cells]})
+
+    return R, region_stats.extract_neighbours(labels), side * side
+
+
+# the grouping loop that grouping.hierarchical_grouping replaced: re-sort every
+# similarity and scan every pair on each merge
+def _grouping_sorted_reference(R, neighbours, calc_sim):
+    S = {}
+    for ai, bi in R.rows(neighbours).tolist():
+        S[(ai, bi)] = calc_sim(R, ai, bi)
+
+    while S != {}:
+        i, j = sorted(S.items(), key=lambda i : i[1])[-1][0]
+        t = R.merge(i, j)
+
+        key_to_delete = []
+        for k, v in S.items():
+            if (i in k) or (j in k):
+                key_to_delete.append(k)
+        for k in key_to_delete:
+            del S[k]
+        for k in filter(lambda a: a != (i, j), key_to_delete):
+            n = k[1] if k[0] in (i, j) else k[0]
+            S[(t, n)] = calc_sim(R, t, n)
+    return R
+
+
+# heap-driven grouping at several initial region counts, against the sorted
+# reference loop up to max_reference regions
+def bench_grouping(region_counts=(500, 2000, 10000), max_reference=2000):
+    print('hierarchical grouping')
+    print('    regions  pairs    heap        sorted reference')
+    for n in region_counts:
+        R, neighbours, imsize = make_synthetic_regions(n)
+        calc_sim = lambda table, i, j: ss_module._calc_sim(table, i, j, imsize)
+
+        start = time.time()
+        out = grouping.hierarchical_grouping(copy.deepcopy(R), neighbours, calc_sim)
+        heap_time = time.time() - start
+
+        line = '    %-8d %-8d %.4fs' % (len(R), len(neighbours), heap_time)
+        if n <= max_reference:
+            start = time.time()
+            ref = _grouping_sorted_reference(copy.deepcopy(R), neighbours, calc_sim)
+            ref_time = time.time() - start
+            line += '  %9.4fs (%.1fx)' % (ref_time, ref_time / heap_time)
+            assert len(ref) == len(out), 'different number of merges'
+        print(line)
+
+
+# the texture stage that texture.lbp_cube replaced: float64 LBP of every
+# channel, then every region masked out of the whole cube for its histogram
+def _texture_reference(img):
+    tex_grad = np.zeros((img.shape[0], img.shape[1], img.shape[2]))
+    for colour_channel in range(img.shape[2]):
+        tex_grad[:, :, colour_channel] = skimage.feature.local_binary_pattern(
+            img[:, :, colour_channel], 8, 1.0)
+
+    hists = {}
+    for k in np.unique(img[:, :, -1]):
+        masked = tex_grad[img[:, :, -1] == k]
+        hist = np.concatenate([np.histogram(masked[:, c], 10, (0.0, 1.0))[0]
+                               for c in range(img.shape[2] - 1)])
+        hists[k] = hist / len(masked)
+    return hists, tex_grad.nbytes
+
+
+# uint8 LBP codes in a process pool with grouped histograms, against the
+# float64 serial texture stage
+def bench_texture(height, width, bands, sigma=0.5, k=500, min_size=50, n_workers=1):
+    cube = make_synthetic_scene(height, width, bands)
+    labels, sizes = graphSeg.segment_hs(cube, sigma, k, min_size)
+    img = np.append(np.transpose(cube, axes=(1, 2, 0)), labels[:, :, np.newaxis], axis=2)
+
+    start = time.time()
+    ref, ref_bytes = _texture_reference(img)
+    ref_time = time.time() - start
+
+    start = time.time()
+    codes = texture.lbp_cube(img[:, :, :-1], n_workers)
+    R = region_stats.extract_regions(img[:, :, -1], texture=codes)
+    new_time = time.time() - start
+
+    hists = R.hists['hist_t'][:len(R)]
+    max_err = max(np.max(np.abs(hists[r] - ref[l])) for r, l in enumerate(R.leaf_labels))
+    print('texture (%d x %d x %d, %d regions, %d worker(s))' % (height, width, bands, len(R), n_workers))
+    print('    float64, masked per region: %.4fs  %7.1f MB' % (ref_time, ref_bytes / 2.0 ** 20))
+    print('    uint8, grouped bincount:    %.4fs  %7.1f MB' % (new_time, codes.nbytes / 2.0 ** 20))
+    print('    speedup:                    %.1fx' % (ref_time / new_time))
+    print('    max histogram difference:   %.2e' % max_err)
+
+
+# throughput of the 12 bit unpackers of readRaw on a file of megabytes of
+# random packed data, in MB/s of packed input
+def bench_unpack(megabytes=64, chunk_mb=3):
+    n_bytes = megabytes * (1 << 20) // 3 * 3
+    fd, file_name = tempfile.mkstemp(suffix='.raw')
+    os.close(fd)
+    try:
+        np.random.RandomState(0).randint(0, 256, size=n_bytes).astype(np.uint8).tofile(file_name)
+        out = np.empty(shape=n_bytes // 3 * 2, dtype=np.uint16)
+
+        paths = [('read_uint12, whole file', lambda: readRaw.read_uint12(np.fromfile(file_name, dtype=np.uint8)))]
+        if readRaw.nb is not None:
+            paths.append(('nb_read_uint12, whole file',
+                          lambda: readRaw.nb_read_uint12(np.fromfile(file_name, dtype=np.uint8))))
+            paths.append(('stream, numba', lambda: readRaw.read_12bit_stream(
+                file_name, out, chunk_bytes=chunk_mb << 20, use_numba=True)))
+        paths.append(('stream, numpy', lambda: readRaw.read_12bit_stream(
+            file_name, out, chunk_bytes=chunk_mb << 20, use_numba=False)))
+
+        print('12 bit unpack (%d MB packed, %d MB chunks)' % (megabytes, chunk_mb))
+        ref = None
+        for name, run in paths:
+            start = time.time()
+            data = run()
+            elapsed = time.time() - start
+            if ref is None:
+                ref = data.copy()
+            assert (data == ref).all(), '%s differs' % name
+            print('    %-28s %8.1f MB/s' % (name, n_bytes / 2.0 ** 20 / elapsed))
+    finally:
+        os.remove(file_name)
+
+
+# best of `repeat` runs of func(*setup()), setup is not timed
+def _time_stage(func, setup, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        args = setup()
+        start = time.time()
+        result = func(*args)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+# time each stage of hyperspectral selective search separately.
+# Returns the run description with the stage timings in seconds.
+def bench_pipeline(height, width, bands, sigma=0.5, k=500, min_size=50, n_regions=40,
+                   repeat=1, seed=0, n_workers=1):
+    cube = make_synthetic_scene(height, width, bands, n_regions=n_regions, seed=seed)
+    stages = OrderedDict()
+
+    stages['smoothing'], smooth_bands = _time_stage(
+        smooth_cube, lambda: (cube, sigma), repeat)
+    smooth_bands = np.transpose(smooth_bands, axes=(1, 2, 0))
+
+    stages['graph_build'], edges = _time_stage(
+        graphSeg.build_graph, lambda: (smooth_bands,), repeat)
+
+    stages['edge_sort'], _ = _time_stage(
+        lambda a, b, w: sort_edges(a, b, w) or (a, b, w),
+        lambda: tuple(e.copy() for e in edges), repeat)
+    edges_a, edges_b, edges_w = edges
+    sort_edges(edges_a, edges_b, edges_w)
+
+    def merge(a, b, w):
+        u = segment_sorted(height * width, a, b, w, k)
+        merge_small_components(u, a, b, min_size)
+        return component_labels(u)
+    stages['merge'], (labels, sizes) = _time_stage(merge, lambda: edges, repeat)
+    labels = labels.reshape(height, width)
+
+    # label image as ss_module._generate_segments builds it
+    img = np.append(np.transpose(cube, axes=(1, 2, 0)), labels[:, :, np.newaxis], axis=2)
+    stages['region_extraction'], R = _time_stage(
+        ss_module._extract_region, lambda: (img, sizes, n_workers), repeat)
+
+    stages['neighbour_extraction'], neighbours = _time_stage(
+        ss_module._extract_neighbours, lambda: (img,), repeat)
+
+    stages['hierarchical_grouping'], _ = _time_stage(
+        ss_module._hierarchical_grouping, lambda: (copy.deepcopy(R), neighbours, height * width), repeat)
+
+    return OrderedDict([
+        ('config', OrderedDict([
+            ('height', height), ('width', width), ('bands', bands), ('sigma', sigma),
+            ('k', k), ('min_size', min_size), ('n_regions', n_regions),
+            ('repeat', repeat), ('seed', seed), ('n_workers', n_workers)])),
+        ('environment', OrderedDict([
+            ('python', platform.python_version()), ('numpy', np.__version__),
+            ('machine', platform.machine()), ('cpu_count', os.cpu_count())])),
+        ('result', OrderedDict([('components', int(len(sizes)))])),
+        ('stages', stages),
+        ('total', sum(stages.values())),
+    ])
+
+
+# print the stage timings of run, with the change against baseline if given.
+# Returns the stages that got slower than baseline by more than tolerance.
+def report_pipeline(run, baseline=None, tolerance=0.2):
+    regressions = []
+    config = run['config']
+    print('pipeline (%d x %d x %d, %d components)' % (
+        config['height'], config['width'], config['bands'], run['result']['components']))
+    for name, elapsed in list(run['stages'].items()) + [('total', run['total'])]:
+        line = '    %-22s %9.4fs' % (name, elapsed)
+        if baseline is not None:
+            before = baseline['total'] if name == 'total' else baseline['stages'].get(name)
+            if before:
+                change = elapsed / before - 1.0
+                line += '  %+7.1f%%' % (100 * change)
+                if change > tolerance and name != 'total':
+                    line += '  REGRESSION'
+                    regressions.append(name)
+        print(line)
+    if baseline is not None and baseline['config'] != config:
+        print('    warning: baseline was run with a different config')
+    return regressions
+
+
+if __name__ == '__main__':
+    parse = argparse.ArgumentParser()
+    parse.add_argument('stage', choices=['pipeline', 'graph', 'smooth', 'reduce', 'sweep', 'grouping', 'texture', 'unpack'])
+    parse.add_argument('--height', type=int, default=120)
+    parse.add_argument('--width', type=int, default=100)
+    parse.add_argument('--bands', type=int, default=128)
+    parse.add_argument('--sigma', type=float, default=0.5)
+    parse.add_argument('--threads', type=int, default=1)
+    parse.add_argument('--k', type=int, default=500)
+    parse.add_argument('--min_size', type=int, default=50)
+    parse.add_argument('--regions', type=int, nargs='+', default=None,
+                       help='pipeline: voronoi cells of the scene (default 40); '
+                            'grouping: initial region counts (default 500 2000 10000)')
+    parse.add_argument('--max_reference', type=int, default=2000)
+    parse.add_argument('--mb', type=int, default=64, help='unpack: megabytes of packed data')
+    parse.add_argument('--repeat', type=int, default=1)
+    parse.add_argument('--seed', type=int, default=0)
+    parse.add_argument('--output', type=str, default=None, help='write the pipeline timings as JSON')
+    parse.add_argument('--baseline', type=str, default=None, help='JSON of an earlier pipeline run')
+    parse.add_argument('--tolerance', type=float, default=0.2, help='slowdown reported as a regression')
+    args = parse.parse_args()
+
+    if args.stage == 'pipeline':
+        run = bench_pipeline(args.height, args.width, args.bands, args.sigma, args.k,
+                             args.min_size, args.regions[0] if args.regions else 40,
+                             args.repeat, args.seed, args.threads)
+        baseline = None
+        if args.baseline is not None:
+            with open(args.baseline) as fd:
+                baseline = json.load(fd)
+        regressions = report_pipeline(run, baseline, args.tolerance)
+        if args.output is not None:
+            with open(args.output, 'w') as fd:
+                json.dump(run, fd, indent=2)
+                fd.write('\n')
+        sys.exit(1 if regressions else 0)
+    elif args.stage == 'graph':
+        bench_graph(args.height, args.width, args.bands)
+    elif args.stage == 'smooth':
+        bench_smooth(args.height, args.width, args.bands, args.sigma, args.threads)
+    elif args.stage == 'reduce':
+        bench_reduce(args.height, args.width, args.bands, args.sigma)
+    elif args.stage == 'sweep':
+        bench_sweep(args.height, args.width, args.bands, args.sigma)
+    elif args.stage == 'grouping':
+        bench_grouping(args.regions or (500, 2000, 10000), args.max_reference)
+    elif args.stage == 'texture':
+        bench_texture(args.height, args.width, args.bands, args.sigma, args.k, args.min_size, args.threads)
+    elif args.stage == 'unpack':
+        bench_unpack(args.mb)
@@ -1,38 +1,52 @@
 import numpy as np
+import numba as nb
 
 
-# disjoint-set forests using union-by-rank and path compression (sort of).
+# disjoint-set forests using union-by-rank and path compression.
+# rank, size and parent are kept in flat arrays so that the compiled
+# kernels in segment_graph can work on them without going through Python.
 class universe:
     def __init__(self, n_elements):
         self.num = n_elements
-        self.elts = np.empty(shape=(n_elements, 3), dtype=int)
-        for i in range(n_elements):
-            self.elts[i, 0] = 0  # rank
-            self.elts[i, 1] = 1  # size
-            self.elts[i, 2] = i  # p
+        self.rank = np.zeros(n_elements, dtype=np.int32)
+        self.sz = np.ones(n_elements, dtype=np.int32)
+        self.p = np.arange(n_elements, dtype=np.int32)
 
     def size(self, x):
-        return self.elts[x, 1]
+        return self.sz[x]
 
     def num_sets(self):
         return self.num
 
     def find(self, x):
-        y = int(x)
-        while y != self.elts[y, 2]:
-            y = self.elts[y, 2]
-        self.elts[x, 2] = y
-        return y
+        return find_set(self.p, x)
 
     def join(self, x, y):
-        # x = int(x)
-        # y = int(y)
-        if self.elts[x, 0] > self.elts[y, 0]:
-            self.elts[y, 2] = x
-            self.elts[x, 1] += self.elts[y, 1]
-        else:
-            self.elts[x, 2] = y
-            self.elts[y, 1] += self.elts[x, 1]
-            if self.elts[x, 0] == self.elts[y, 0]:
-                self.elts[y, 0] += 1
+        join_sets(self.p, self.rank, self.sz, x, y)
         self.num -= 1
+
+
+# root of x, pointing every node on the path directly at it
+@nb.njit(cache=True)
+def find_set(p, x):
+    root = x
+    while root != p[root]:
+        root = p[root]
+    while x != root:
+        parent = p[x]
+        p[x] = root
+        x = parent
+    return root
+
+
+# join the two roots x and y by rank
+@nb.njit(cache=True)
+def join_sets(p, rank, size, x, y):
+    if rank[x] > rank[y]:
+        p[y] = x
+        size[x] += size[y]
+    else:
+        p[x] = y
+        size[y] += size[x]
+        if rank[x] == rank[y]:
+            rank[y] += 1
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+'''
+Diversified selective search: several grouping strategies (colour space,
+similarity measures, segmentation scale) run side by side and their
+hierarchies merged into one ranked proposal list, as in "Selective Search
+for Object Recognition" by J.R.R. Uijlings et al.
+
+Each region gets the rank RND * position, where position is 1 for the last
+region merged by its strategy (the whole image) and grows towards the
+initial regions, and RND is uniform in [0, 1). Regions are returned by
+increasing rank, so the top of every hierarchy comes first while no single
+strategy dominates. Identical rects keep their best rank only.
+'''
+
+__author__ = 'smh'
+__date__ = '2018.10.17'
+
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import numpy as np
+
+
+# run(*args) for every args in strategies, in a pool of n_workers processes
+# (all cores by default, in this process if 1). run must be a module level
+# function so the spawned workers can import it.
+# Returns the results in the order of strategies.
+def run_strategies(run, strategies, n_workers=None):
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    n_workers = min(n_workers, len(strategies))
+
+    if n_workers <= 1:
+        return [run(*args) for args in strategies]
+
+    # spawned like the workers of graphSeg, numba's threads do not survive a fork
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = [pool.submit(run, *args) for args in strategies]
+        return [future.result() for future in futures]
+
+
+# Merge the hierarchies of several strategies by the pseudo-random rank.
+#   hierarchies: (rects (n, 4), sizes (n,)) per strategy, in merge order:
+#                the initial regions first, the last merged region last
+#   seed: seed of RND, the same seed gives the same order
+# Returns (rects, sizes, ranks, strategy index) of the unique rects by
+# increasing rank.
+def rank_regions(hierarchies, seed=0):
+    rng = np.random.RandomState(seed)
+    rects, sizes, ranks, strategy = [], [], [], []
+    for s, (r, sz) in enumerate(hierarchies):
+        n = len(r)
+        position = np.arange(n, 0, -1, dtype=np.float64)
+        rects.append(np.asarray(r, dtype=np.int64).reshape(n, 4))
+        sizes.append(np.asarray(sz, dtype=np.int64))
+        ranks.append(rng.uniform(0, 1, size=n) * position)
+        strategy.append(np.full(n, s, dtype=np.int64))
+    rects = np.concatenate(rects) if rects else np.zeros(shape=(0, 4), dtype=np.int64)
+    sizes = np.concatenate(sizes) if sizes else np.zeros(shape=0, dtype=np.int64)
+    ranks = np.concatenate(ranks) if ranks else np.zeros(shape=0)
+    strategy = np.concatenate(strategy) if strategy else np.zeros(shape=0, dtype=np.int64)
+
+    order = np.argsort(ranks, kind='stable')
+    # first occurrence of each rect in rank order is its best rank
+    _, first = np.unique(rects[order], axis=0, return_index=True)
+    keep = order[np.sort(first)]
+
+    return rects[keep], sizes[keep], ranks[keep], strategy[keep]
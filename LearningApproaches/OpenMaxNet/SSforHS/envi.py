@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+'''
+ENVI style raw hyperspectral cubes, memory-mapped.
+
+The layout comes from the .hdr next to the raw file (hs_img.hdr or
+hs_img.raw.hdr for hs_img.raw), or is given explicitly:
+    bsq: band sequential,          stored as (bands, lines, samples)
+    bil: band interleaved by line, stored as (lines, bands, samples)
+    bip: band interleaved by pixel, stored as (lines, samples, bands)
+Whatever the interleave, RawCube.cube is a (bands, lines, samples) view of the
+memmap, so a band, a range of lines or a window only reads its own pixels.
+A quick look at a cube (rgb_preview, read_preview) reads the three bands it
+shows and nothing else.
+'''
+
+__author__ = 'smh'
+__date__ = '2018.10.22'
+
+import os
+import re
+import numpy as np
+
+# ENVI "data type" codes
+DATA_TYPES = {1: np.uint8, 2: np.int16, 3: np.int32, 4: np.float32, 5: np.float64,
+              12: np.uint16, 13: np.uint32, 14: np.int64, 15: np.uint64}
+
+# storage order of each interleave, as axes of (bands, lines, samples)
+INTERLEAVES = {'bsq': (0, 1, 2), 'bil': (1, 0, 2), 'bip': (1, 2, 0)}
+
+# layout of a raw file without a header, where not given explicitly
+DEFAULT_LAYOUT = {'interleave': 'bsq', 'data type': 12, 'header offset': 0, 'byte order': 0}
+
+
+# the .hdr of raw file file_name, None if there is none
+def find_header(file_name):
+    for path in (os.path.splitext(file_name)[0] + '.hdr', file_name + '.hdr'):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+# "key = value" pairs of an ENVI header as a dict with lower case keys,
+# {...} values (which may span lines) are kept as strings without the braces
+def read_header(hdr_name):
+    with open(hdr_name, 'r') as fd:
+        text = fd.read()
+    if not text.lstrip().startswith('ENVI'):
+        raise ValueError('Not an ENVI header: %s' % hdr_name)
+
+    header = {}
+    for match in re.finditer(r'^\s*([^=\n]+?)\s*=\s*(\{[^}]*\}|[^\n]*)', text, re.MULTILINE):
+        key, value = match.group(1).strip().lower(), match.group(2).strip()
+        if value.startswith('{'):
+            value = value[1:-1].strip()
+        header[key] = value
+    return header
+
+
+class RawCube(object):
+    # file_name: raw file
+    # samples, lines, bands, interleave ('bsq', 'bil' or 'bip'), dtype,
+    # offset (header bytes) and byte_order (0 little, 1 big endian): the
+    # layout, read from the .hdr of file_name for every one left as None
+    # defaults: header keys to use when neither given nor in a header, over
+    # DEFAULT_LAYOUT, e.g. {'samples': 696, 'lines': 587, 'interleave': 'bil'}
+    def __init__(self, file_name, samples=None, lines=None, bands=None, interleave=None,
+                 dtype=None, offset=None, byte_order=None, defaults=None):
+        header = {}
+        if None in (samples, lines, bands, interleave, dtype):
+            hdr_name = find_header(file_name)
+            if hdr_name is not None:
+                header = read_header(hdr_name)
+        fallback = dict(DEFAULT_LAYOUT)
+        fallback.update(defaults or {})
+
+        def pick(value, key, convert):
+            if value is not None:
+                return value
+            if key in header:
+                return convert(header[key])
+            if key in fallback:
+                return convert(fallback[key])
+            raise ValueError('%s of %s is not given and has no header' % (key, file_name))
+
+        self.samples = pick(samples, 'samples', int)
+        self.lines = pick(lines, 'lines', int)
+        self.bands = pick(bands, 'bands', int)
+        self.interleave = pick(interleave, 'interleave', str).lower()
+        dtype = pick(dtype, 'data type', lambda v: DATA_TYPES[int(v)])
+        offset = pick(offset, 'header offset', int)
+        byte_order = pick(byte_order, 'byte order', int)
+        if self.interleave not in INTERLEAVES:
+            raise ValueError('Unknown interleave: %s' % self.interleave)
+
+        dtype = np.dtype(dtype).newbyteorder('>' if byte_order else '<')
+        axes = INTERLEAVES[self.interleave]
+        dims = (self.bands, self.lines, self.samples)
+        self.file_name = file_name
+        self.raw = np.memmap(file_name, dtype=dtype, mode='r', offset=offset,
+                             shape=tuple(dims[a] for a in axes))
+        # (bands, lines, samples) whatever the storage order, still on disk
+        self.cube = np.transpose(self.raw, np.argsort(axes))
+
+    @property
+    def shape(self):
+        return self.cube.shape
+
+    # band b, (lines, samples)
+    def band(self, b):
+        return np.array(self.cube[b])
+
+    # the given bands, (len(bands), lines, samples)
+    def read_bands(self, bands):
+        return np.array(self.cube[list(bands)])
+
+    # lines y0 to y1 of every band, (bands, y1 - y0, samples)
+    def read_lines(self, y0, y1):
+        return np.array(self.cube[:, y0:y1])
+
+    # window of lines y0 to y1 and samples x0 to x1 of the given bands (all by
+    # default), (bands, y1 - y0, x1 - x0)
+    def read_window(self, y0, y1, x0, x1, bands=None):
+        if bands is None:
+            return np.array(self.cube[:, y0:y1, x0:x1])
+        return np.array(self.cube[list(bands), y0:y1, x0:x1])
+
+    # uint8 (lines, samples, len(bands)) preview of the given bands, see rgb_preview
+    def preview(self, bands=(93, 85, 55)):
+        return rgb_preview(self.cube, bands)
+
+
+# (bands, lines, samples) memmap view of a raw file, see RawCube
+def open_cube(file_name, samples=None, lines=None, bands=None, interleave=None, **layout):
+    return RawCube(file_name, samples, lines, bands, interleave, **layout).cube
+
+
+# uint8 (H, W, len(bands)) preview of the given bands of a (bands, H, W) cube,
+# channels in the order of bands, scaled so the largest of their values is 255.
+# The bands are copied one at a time out of the (memmap) cube, so only their
+# pixels are read: for bsq and bil one strided row per line, for bip every
+# pixel still comes in with its page.
+def rgb_preview(cube, bands=(93, 85, 55)):
+    img = np.empty(shape=(cube.shape[1], cube.shape[2], len(bands)), dtype=np.float32)
+    for c, b in enumerate(bands):
+        img[:, :, c] = cube[b]
+    peak = np.max(img)
+    if peak > 0:
+        img /= peak
+        img *= 255
+    return img.astype(np.uint8)
+
+
+# rgb_preview of the given bands of a raw file, (lines, samples, len(bands))
+def read_preview(file_name, bands=(93, 85, 55), samples=None, lines=None, n_bands=None,
+                 interleave=None, **layout):
+    return RawCube(file_name, samples, lines, n_bands, interleave, **layout).preview(bands)
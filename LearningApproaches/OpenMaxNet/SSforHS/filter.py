@@ -1,5 +1,6 @@
 import numpy as np
 import math
+from concurrent.futures import ThreadPoolExecutor
 np.seterr(over='ignore')
 
 
@@ -34,8 +35,8 @@ def normalize(mask):
 
 # convolve src with mask.  output is flipped!
 def convolve_even(src, mask):
-    output = np.zeros(shape=src.shape, dtype=float)
     height, width = src.shape
+    output = np.zeros(shape=(width, height), dtype=float)
     length = len(mask)
 
     for y in range(height):
@@ -43,5 +44,53 @@ def convolve_even(src, mask):
             sum = float(mask[0] * src[y, x])
             for i in range(1, length):
                 sum += mask[i] * (src[y, max(x - i, 0)] + src[y, min(x + i, width - 1)])
-            output[y, x] = sum
+            output[x, y] = sum
+    return output
+
+
+# convolve every band of cube (bands, height, width) with the same gaussian
+# as smooth(), splitting the bands over n_threads threads.
+def smooth_cube(cube, sigma, n_threads=1, dtype=np.float32, block=4):
+    mask = make_fgauss(sigma)
+    mask = normalize(mask).astype(dtype)
+    output = np.empty(shape=cube.shape, dtype=dtype)
+
+    def smooth_chunk(band_idx):
+        # a few bands at a time so the temporaries stay in cache
+        for start in range(band_idx[0], band_idx[-1] + 1, block):
+            stop = min(start + block, band_idx[-1] + 1)
+            chunk = cube[start:stop].astype(dtype)
+            tmp = convolve_axis(chunk, mask, axis=2)
+            output[start:stop] = convolve_axis(tmp, mask, axis=1)
+
+    chunks = [c for c in np.array_split(np.arange(cube.shape[0]), max(n_threads, 1)) if len(c)]
+    if len(chunks) == 1:
+        smooth_chunk(chunks[0])
+    else:
+        # numpy releases the GIL in the element-wise kernels below
+        with ThreadPoolExecutor(max_workers=len(chunks)) as pool:
+            list(pool.map(smooth_chunk, chunks))
+    return output
+
+
+# convolve src with mask along one axis, clamping indices at the borders
+# exactly as convolve_even does.
+def convolve_axis(src, mask, axis):
+    length = len(mask)
+    n = src.shape[axis]
+    pad = [(0, 0)] * src.ndim
+    pad[axis] = (length - 1, length - 1)
+    padded = np.pad(src, pad, mode='edge')
+
+    def shifted(offset):
+        index = [slice(None)] * src.ndim
+        index[axis] = slice(length - 1 + offset, length - 1 + offset + n)
+        return padded[tuple(index)]
+
+    output = mask[0] * src
+    tmp = np.empty_like(output)
+    for i in range(1, length):
+        np.add(shifted(-i), shifted(i), out=tmp)
+        tmp *= mask[i]
+        output += tmp
     return output
@@ -8,27 +8,67 @@ __date__ = '2018.09.12'
 
 from filter import *
 from segment_graph import *
+from band_reduce import fit_projection, project_bands
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from collections import OrderedDict
+import hashlib
+import multiprocessing
+import os
 import time
 import numpy as np
 import cv2
 import readRaw
 
 
-def segment_hs(hs_img, sigma, k, min_size):
-    start_time = time.time()
-    bands, height, width = hs_img.shape
-    hs_img = np.transpose(hs_img, axes=(1, 2, 0)) # change the bands to the last dims
-
-    smooth_bands = []
-    for idx in range(bands):
-        img = hs_img[:, :, idx]
-        smooth_img = smooth(img, sigma)
-        smooth_bands.append(smooth_img)
-    smooth_bands = np.array(smooth_bands)
-    smooth_bands = np.transpose(smooth_bands, axes=(1, 2, 0))
-    print('shape of smooth_bands: ', smooth_bands.shape)
+# build the 8-neighbour graph (right, down and both diagonals) of smooth_bands
+# with shape (height, width, bands).
+# Returns the edge endpoints as int32 pixel indices and the float32 weights,
+# grouped by direction instead of interleaved per pixel.
+# diag_rows: rows with (y, x) -> (y+1, x+1) edges, height - 2 by default as in
+# build_graph_loop; a tile that is not at the bottom of the scene has them on
+# all its height - 1 rows.
+def build_graph(smooth_bands, diag_rows=None):
+    height, width, bands = smooth_bands.shape
+    if diag_rows is None:
+        diag_rows = max(height - 2, 0)
+    index = np.arange(height * width, dtype=np.int32).reshape(height, width)
+    weights = edge_weights
+
+    # (y, x) -> (y, x+1)
+    right_a = index[:, :-1]
+    right_b = index[:, 1:]
+    right_w = weights(smooth_bands[:, :-1], smooth_bands[:, 1:])
+    # (y, x) -> (y+1, x)
+    down_a = index[:-1, :]
+    down_b = index[1:, :]
+    down_w = weights(smooth_bands[:-1, :], smooth_bands[1:, :])
+    # (y, x) -> (y+1, x+1), only for y < diag_rows
+    diag_a = index[:diag_rows, :-1]
+    diag_b = index[1:diag_rows + 1, 1:]
+    diag_w = weights(smooth_bands[:diag_rows, :-1], smooth_bands[1:diag_rows + 1, 1:])
+    # (y, x) -> (y-1, x+1)
+    anti_a = index[1:, :-1]
+    anti_b = index[:-1, 1:]
+    anti_w = weights(smooth_bands[1:, :-1], smooth_bands[:-1, 1:])
+
+    edges_a = np.concatenate([e.ravel() for e in (right_a, down_a, diag_a, anti_a)])
+    edges_b = np.concatenate([e.ravel() for e in (right_b, down_b, diag_b, anti_b)])
+    edges_w = np.concatenate([e.ravel() for e in (right_w, down_w, diag_w, anti_w)])
+
+    return edges_a, edges_b, edges_w
+
+
+# weight of the edges between the pixels of p and q, both (..., bands)
+def edge_weights(p, q):
+    # band-wise dot product without a (..., bands) temporary.  projected bands
+    # (see band_reduce) can be negative, so clip before the square root
+    dot = np.einsum('...k,...k->...', p, q)
+    return np.sqrt(np.maximum(dot, 0)).astype(np.float32)
 
-    # build graph
+
+# reference per-pixel implementation of build_graph, kept for timing comparisons
+def build_graph_loop(smooth_bands):
+    height, width, bands = smooth_bands.shape
     edges_size = width * height * 4
     edges = np.zeros(shape=(edges_size, 3), dtype=object)
     num = 0
@@ -55,45 +95,333 @@ def segment_hs(hs_img, sigma, k, min_size):
                 edges[num, 2] = np.sqrt(np.dot(smooth_bands[y, x, :], smooth_bands[y - 1, x + 1, :]))
                 num += 1
 
-    print('graph construct done.')
-    u = segment_graph(width * height, num, edges, k)
+    return (edges[:num, 0].astype(np.int32), edges[:num, 1].astype(np.int32),
+            edges[:num, 2].astype(np.float32))
+
 
-    for i in range(num):
-        a = u.find(edges[i, 0])
-        b = u.find(edges[i, 1])
-        if (a != b) and ((u.size(a) < min_size) or (u.size(b) < min_size)):
-            u.join(a, b)
+# Returns the (height, width) int32 component label map, numbered 0..K-1,
+# and the pixel count of each component.
+# With n_components set, the edge weights are computed on the cube projected
+# onto that many components with band_reduce (reduction: 'pca', 'random' or 'bin').
+def segment_hs(hs_img, sigma, k, min_size, n_components=None, reduction='pca'):
+    start_time = time.time()
+    context = SegmentationContext(hs_img, sigma, n_components, reduction)
+    labels, sizes = context.segment(k, min_size)
 
-    #output = np.zeros(shape=(height, width, 3))
-    output = np.zeros(shape=(height, width))
+    elapsed_time = time.time() - start_time
+    print("Execution time: " + str(int(elapsed_time / 60)) + " minute(s) and " + str(
+             int(elapsed_time % 60)) + " seconds")
 
-    # pick random colors for each component
-    colors = np.zeros(shape=(height * width, 3))
-    #colors = np.zeros(shape=(height * width))
-    for i in range(height * width):
-        colors[i, :] = random_rgb()
-        #colors[i] = i
+    return labels, sizes
+
+
+# The smoothed graph of one cube with its edges sorted by weight, so that it
+# can be segmented for many (k, min_size) without smoothing, building and
+# sorting again.  About 12 bytes per edge, ~4 edges per pixel.
+class SegmentationContext:
+    def __init__(self, hs_img, sigma, n_components=None, reduction='pca'):
+        bands, height, width = hs_img.shape
+        self.shape = (height, width)
+
+        if n_components is not None:
+            # the projection is linear, so projecting before smoothing is
+            # equivalent and smooths fewer bands
+            hs_img = project_bands(hs_img, fit_projection(hs_img, n_components, reduction))
+
+        smooth_bands = smooth_cube(hs_img, sigma)
+        smooth_bands = np.transpose(smooth_bands, axes=(1, 2, 0)) # change the bands to the last dims
+        print('shape of smooth_bands: ', smooth_bands.shape)
+
+        # build graph
+        self.edges_a, self.edges_b, self.edges_w = build_graph(smooth_bands)
+        sort_edges(self.edges_a, self.edges_b, self.edges_w)
+        print('graph construct done.')
+
+    # Returns the label map and component sizes as segment_hs does
+    def segment(self, k, min_size):
+        height, width = self.shape
+        u = segment_sorted(height * width, self.edges_a, self.edges_b, self.edges_w, k)
+        merge_small_components(u, self.edges_a, self.edges_b, min_size)
+
+        labels, sizes = component_labels(u)
+        return labels.reshape(height, width), sizes
+
+
+# least recently used SegmentationContexts, keyed by cube content and smoothing
+MAX_CONTEXTS = 4
+_contexts = OrderedDict()
+
+
+# SegmentationContext for hs_img, reusing one built earlier for the same cube
+# and parameters.  At most max_contexts are kept; key (see cube_key) can be
+# given so that a cube in memory is not hashed on every call.
+def get_context(hs_img, sigma, n_components=None, reduction='pca', key=None, max_contexts=None):
+    if key is None:
+        key = cube_key(hs_img)
+    key = (key, sigma, n_components, reduction)
+    if max_contexts is None:
+        max_contexts = MAX_CONTEXTS
+
+    if key in _contexts:
+        _contexts.move_to_end(key)
+        return _contexts[key]
+
+    context = SegmentationContext(hs_img, sigma, n_components, reduction)
+    _contexts[key] = context
+    while len(_contexts) > max_contexts:
+        _contexts.popitem(last=False)
+    return context
+
+
+def clear_contexts():
+    _contexts.clear()
 
-    for y in range(height):
-        for x in range(width):
-            comp = u.find(y * width + x)
-            output[y, x] = np.mean(colors[comp])
-            #output[y, x, :] = colors[comp, :]
+
+# key of the content of cube for get_context.  A cube on a read-only np.memmap
+# (readRaw, envi) is known by its file, the file's size and modification time
+# and where in the file the view lies, without reading it; any other cube by
+# cube_fingerprint, so callers segmenting one in-memory cube many times should
+# compute its key once and pass it on.
+def cube_key(cube):
+    root = cube
+    while isinstance(root.base, np.ndarray):
+        root = root.base
+    if isinstance(root, np.memmap) and root.mode == 'r' and root.filename is not None:
+        stat = os.stat(root.filename)
+        offset = root.offset + cube.__array_interface__['data'][0] - root.__array_interface__['data'][0]
+        return ('memmap', root.filename, stat.st_size, stat.st_mtime_ns, offset,
+                cube.shape, cube.strides, cube.dtype.str)
+    return cube_fingerprint(cube)
+
+
+# sha1 of the shape, dtype and content of cube, read a block of rows at a time
+def cube_fingerprint(cube, block=64):
+    digest = hashlib.sha1(str((cube.shape, cube.dtype.str)).encode())
+    for y in range(0, cube.shape[1], block):
+        digest.update(np.ascontiguousarray(cube[:, y:y + block]).tobytes())
+    return digest.hexdigest()
+
+
+# segment_hs over tile_size x tile_size tiles segmented in a pool of n_workers
+# processes, so that only the tiles in flight are held in memory and hs_img can
+# be an np.memmap of a scene larger than RAM.  Each tile is smoothed with
+# `overlap` pixels of context from its neighbours (enough for the gaussian by
+# default), the components are then merged across the tile seams with the
+# same threshold rule, and the min_size pass runs on the component graph.
+def segment_hs_tiled(hs_img, sigma, k, min_size, tile_size=512, overlap=None, n_workers=None,
+                     n_components=None, reduction='pca'):
+    start_time = time.time()
+    bands, height, width = hs_img.shape
+    # one projection for the whole scene, so the tiles stay comparable
+    projection = None
+    if n_components is not None:
+        projection = fit_projection(hs_img, n_components, reduction)
+        bands = n_components
+    if overlap is None:
+        overlap = len(make_fgauss(sigma)) - 1
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    seam_ys = list(range(tile_size, height, tile_size))
+    seam_xs = list(range(tile_size, width, tile_size))
+
+    comp_map = np.empty(shape=(height, width), dtype=np.int32)
+    comp_sizes = []
+    comp_internal = []
+    comp_edges = []
+    row_strips = {}   # y -> smoothed row y, (width, bands)
+    col_strips = {}   # x -> smoothed column x, (height, bands)
+    num_comps = 0
+
+    def collect(future, box):
+        nonlocal num_comps
+        y0, y1, x0, x1 = box
+        labels, sizes, internal, edges, strips = future.result()
+        comp_map[y0:y1, x0:x1] = labels + num_comps
+        comp_sizes.append(sizes)
+        comp_internal.append(internal)
+        comp_edges.append((edges[0] + num_comps, edges[1] + num_comps, edges[2]))
+        top, bottom, left, right = strips
+        if top is not None:
+            row_strips.setdefault(y0, np.empty((width, bands), dtype=top.dtype))[x0:x1] = top
+        if bottom is not None:
+            row_strips.setdefault(y1 - 1, np.empty((width, bands), dtype=bottom.dtype))[x0:x1] = bottom
+        if left is not None:
+            col_strips.setdefault(x0, np.empty((height, bands), dtype=left.dtype))[y0:y1] = left
+        if right is not None:
+            col_strips.setdefault(x1 - 1, np.empty((height, bands), dtype=right.dtype))[y0:y1] = right
+        num_comps += len(sizes)
+
+    # numba's thread pool does not survive a fork, so the workers are spawned
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        pending = {}
+        for y0 in range(0, height, tile_size):
+            for x0 in range(0, width, tile_size):
+                y1 = min(y0 + tile_size, height)
+                x1 = min(x0 + tile_size, width)
+                hy0, hy1 = max(y0 - overlap, 0), min(y1 + overlap, height)
+                hx0, hx1 = max(x0 - overlap, 0), min(x1 + overlap, width)
+                tile = np.array(hs_img[:, hy0:hy1, hx0:hx1])
+                core = (y0 - hy0, x0 - hx0, y1 - y0, x1 - x0)
+                seams = (y0 > 0, y1 < height, x0 > 0, x1 < width)
+                future = pool.submit(_segment_tile, tile, core, seams, sigma, k, min_size, projection)
+                pending[future] = (y0, y1, x0, x1)
+                # bound the number of tiles held in memory
+                if len(pending) >= 2 * n_workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future, pending.pop(future))
+        for future in list(pending):
+            collect(future, pending.pop(future))
+    print('tiles segmented: %d components' % num_comps)
+
+    sizes = np.concatenate(comp_sizes)
+    internal = np.concatenate(comp_internal)
+    u = universe(num_comps)
+    u.sz[:] = sizes
+
+    # threshold pass over the pixel edges crossing the seams
+    seam_a, seam_b, seam_w = _seam_edges(row_strips, col_strips, seam_ys, seam_xs, height, width)
+    flat_map = comp_map.ravel()
+    seam_a = flat_map[seam_a]
+    seam_b = flat_map[seam_b]
+    sort_edges(seam_a, seam_b, seam_w)
+    threshold = internal + k / sizes
+    u.num -= segment_edges(u.p, u.rank, u.sz, threshold, seam_a, seam_b, seam_w, k)
+
+    # min_size pass over the component graph
+    edges_a = np.concatenate([e[0] for e in comp_edges] + [seam_a])
+    edges_b = np.concatenate([e[1] for e in comp_edges] + [seam_b])
+    edges_w = np.concatenate([e[2] for e in comp_edges] + [seam_w])
+    sort_edges(edges_a, edges_b, edges_w)
+    merge_small_components(u, edges_a, edges_b, min_size)
+
+    comp_labels, sizes = component_labels(u)
+    labels = comp_labels[comp_map]
 
     elapsed_time = time.time() - start_time
     print("Execution time: " + str(int(elapsed_time / 60)) + " minute(s) and " + str(
              int(elapsed_time % 60)) + " seconds")
 
-    #print('shape of result: ', output.shape)
-    #print('type of result: ', type(output))
-    #print('max value of result: ', np.max(output))
-    #print('min value of result: ', np.min(output))
-    output = output.astype(np.uint8)
+    return labels, sizes
+
+
+# segment one tile of segment_hs_tiled.
+#   core: (top, left, height, width) of the tile inside its overlap
+#   seams: whether the (top, bottom, left, right) sides of the core are seams
+def _segment_tile(tile, core, seams, sigma, k, min_size, projection=None):
+    top, left, height, width = core
+    if projection is not None:
+        tile = project_bands(tile, projection)
+    smooth_bands = smooth_cube(tile, sigma)[:, top:top + height, left:left + width]
+    smooth_bands = np.transpose(smooth_bands, axes=(1, 2, 0))
+
+    edges_a, edges_b, edges_w = _tile_graph(smooth_bands, seams[1])
+    sort_edges(edges_a, edges_b, edges_w)
+    u = universe(height * width)
+    threshold = np.full(height * width, get_threshold(1, k), dtype=float)
+    u.num -= segment_edges(u.p, u.rank, u.sz, threshold, edges_a, edges_b, edges_w, k)
+    # internal difference of each component, as used by the threshold rule
+    internal = threshold - k / u.sz
+
+    # components touching a seam can still grow across it, so they are kept
+    # out of the min_size pass here and handled on the component graph
+    roots = find_all(u.p).reshape(height, width)
+    on_seam = np.zeros(height * width, dtype=bool)
+    for side, has_seam in zip((roots[0], roots[-1], roots[:, 0], roots[:, -1]), seams):
+        if has_seam:
+            on_seam[side] = True
+    roots = roots.ravel()
+    keep = ~(on_seam[roots[edges_a]] | on_seam[roots[edges_b]])
+    merge_small_components(u, edges_a[keep], edges_b[keep], min_size)
+
+    labels, sizes = component_labels(u)
+    comp_roots = np.flatnonzero(u.p == np.arange(height * width))
+    internal = internal[comp_roots]
+
+    # component graph edges that can still take part in the min_size pass,
+    # keeping the lightest edge between two components
+    open_comps = on_seam[comp_roots] | (sizes < min_size)
+    la = labels[edges_a]
+    lb = labels[edges_b]
+    mask = (la != lb) & (open_comps[la] | open_comps[lb])
+    la, lb, lw = la[mask], lb[mask], edges_w[mask]
+    key = np.minimum(la, lb).astype(np.int64) * len(sizes) + np.maximum(la, lb)
+    _, first = np.unique(key, return_index=True)
+    edges = (la[first], lb[first], lw[first])
+
+    has_top, has_bottom, has_left, has_right = seams
+    strips = (smooth_bands[0].copy() if has_top else None,
+              smooth_bands[-1].copy() if has_bottom else None,
+              smooth_bands[:, 0].copy() if has_left else None,
+              smooth_bands[:, -1].copy() if has_right else None)
+
+    return labels.reshape(height, width), sizes, internal, edges, strips
+
+
+# build_graph edges of one tile of segment_hs_tiled, (height, width, bands).
+# The scene's last row without diagonals is only the tile's own last row when
+# the tile is at the bottom of the scene (no seam below it)
+def _tile_graph(smooth_bands, has_bottom):
+    height = smooth_bands.shape[0]
+    return build_graph(smooth_bands, height - 1 if has_bottom else None)
+
+
+# the edges of build_graph on the whole of smooth_bands (height, width, bands)
+# as segment_hs_tiled makes them: within each tile_size tile, in scene pixel
+# indices, and across the seams
+def tiled_graph_edges(smooth_bands, tile_size):
+    height, width = smooth_bands.shape[:2]
+    index = np.arange(height * width, dtype=np.int64).reshape(height, width)
+    seam_ys = list(range(tile_size, height, tile_size))
+    seam_xs = list(range(tile_size, width, tile_size))
+    edges = []
+    for y0 in range(0, height, tile_size):
+        for x0 in range(0, width, tile_size):
+            y1 = min(y0 + tile_size, height)
+            x1 = min(x0 + tile_size, width)
+            a, b, w = _tile_graph(smooth_bands[y0:y1, x0:x1], y1 < height)
+            tile_index = index[y0:y1, x0:x1].ravel()
+            edges.append((tile_index[a], tile_index[b], w))
+    row_strips = dict((y, smooth_bands[y]) for y0 in seam_ys for y in (y0 - 1, y0))
+    col_strips = dict((x, smooth_bands[:, x]) for x0 in seam_xs for x in (x0 - 1, x0))
+    edges.append(_seam_edges(row_strips, col_strips, seam_ys, seam_xs, height, width))
+
+    return (np.concatenate([e[0] for e in edges]), np.concatenate([e[1] for e in edges]),
+            np.concatenate([e[2] for e in edges]))
+
+
+# build_graph edges crossing the tile seams of segment_hs_tiled, from the
+# smoothed rows and columns on either side of each seam
+def _seam_edges(row_strips, col_strips, seam_ys, seam_xs, height, width):
+    edges = []
+    ys = np.arange(height, dtype=np.int64)
+    xs = np.arange(width, dtype=np.int64)
+    for x0 in seam_xs:
+        left, right = col_strips[x0 - 1], col_strips[x0]
+        a = ys * width + x0 - 1
+        b = ys * width + x0
+        edges.append((a, b, edge_weights(left, right)))
+        edges.append((a[:-2], b[1:-1], edge_weights(left[:-2], right[1:-1])))
+        edges.append((a[1:], b[:-1], edge_weights(left[1:], right[:-1])))
+    for y0 in seam_ys:
+        top, bottom = row_strips[y0 - 1], row_strips[y0]
+        a = (y0 - 1) * width + xs
+        b = y0 * width + xs
+        edges.append((a, b, edge_weights(top, bottom)))
+        if y0 < height - 1:
+            edges.append((a[:-1], b[1:], edge_weights(top[:-1], bottom[1:])))
+        edges.append((b[:-1], a[1:], edge_weights(bottom[:-1], top[1:])))
+    if not edges:
+        return (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32),
+                np.zeros(0, dtype=np.float32))
 
-    #cv2.imshow('Test Output', output)
-    #cv2.waitKey()
+    edges_a = np.concatenate([e[0] for e in edges])
+    edges_b = np.concatenate([e[1] for e in edges])
+    edges_w = np.concatenate([e[2] for e in edges])
+    # diagonal edges at the corners of four tiles cross both seams
+    _, first = np.unique(edges_a * (height * width) + edges_b, return_index=True)
 
-    return output
+    return edges_a[first], edges_b[first], edges_w[first]
 
 
 if __name__ == '__main__':
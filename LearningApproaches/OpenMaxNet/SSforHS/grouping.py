@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+'''
+Hierarchical grouping of selective search, shared by ssModule, ss_module and
+SelectiveSearch/ss_module_hs.
+
+The similarities live in a heap. Pairs that involve a region which has
+already been merged are dropped when they come off the heap, and each region
+keeps the set of its neighbours. A merge therefore costs O(degree * log n)
+instead of re-sorting and scanning every pair, and the similarities of a new
+region to all of its neighbours are computed in one call.
+'''
+
+__author__ = 'smh'
+__date__ = '2018.10.08'
+
+import heapq
+import numpy as np
+
+
+# Merge the most similar pair of neighbouring regions of table until none is
+# left, adding each merged region to the table (see region_table.RegionTable).
+#   table: RegionTable of the initial regions
+#   neighbours: (label, label) pairs, e.g. the (n, 2) array of
+#               region_stats.extract_neighbours
+#   calc_sim(table, i, j): similarity of rows i and j, higher merges first.
+#                          i and j may be arrays of rows, or one row and an
+#                          array of rows, and an array is returned
+#   block: pairs scored per calc_sim call for the initial regions
+# Returns table.
+def hierarchical_grouping(table, neighbours, calc_sim, block=4096):
+    if not len(table):
+        return table
+
+    pairs = table.rows(np.asarray(neighbours).reshape(-1, 2)).tolist()
+    adjacency = dict((i, set()) for i in range(len(table)))
+    for i, j in pairs:
+        if i != j:
+            adjacency[i].add(j)
+            adjacency[j].add(i)
+
+    pairs = np.array([(i, j) for i, nbrs in adjacency.items() for j in nbrs if i < j],
+                     dtype=np.int64).reshape(-1, 2)
+    heap = []
+    for start in range(0, len(pairs), block):
+        i, j = pairs[start:start + block].T
+        sims = calc_sim(table, i, j)
+        heap.extend(zip((-sims).tolist(), i.tolist(), j.tolist()))
+    heapq.heapify(heap)
+
+    while heap:
+        _, i, j = heapq.heappop(heap)
+        # stale pair, one of the regions has been merged already
+        if i not in adjacency or j not in adjacency:
+            continue
+
+        t = table.merge(i, j)
+        nbrs = (adjacency.pop(i) | adjacency.pop(j)) - {i, j}
+        for n in nbrs:
+            adjacency[n].discard(i)
+            adjacency[n].discard(j)
+            adjacency[n].add(t)
+        if nbrs:
+            rows = np.fromiter(nbrs, dtype=np.int64, count=len(nbrs))
+            sims = calc_sim(table, t, rows)
+            for sim, n in zip((-sims).tolist(), rows.tolist()):
+                heapq.heappush(heap, (sim, t, n))
+        adjacency[t] = nbrs
+
+    return table
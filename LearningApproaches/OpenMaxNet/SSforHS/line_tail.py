@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+'''
+Follow a raw push-broom capture while the sensor is still writing it.
+
+The sensor appends whole lines (all bands of one line of samples) to the
+file, so a BIL or BIP file can be read a block of lines at a time as soon
+as the block is complete. Each block is an np.memmap of its own lines, in
+the (bands, lines, samples) order of envi.RawCube.cube, so nothing is
+copied and nothing is buffered: the consumer sets the pace, and a consumer
+that falls behind only leaves lines waiting on disk. With max_lag set, a
+consumer that falls further behind than that skips ahead to the newest
+lines instead.
+'''
+
+__author__ = 'smh'
+__date__ = '2018.10.25'
+
+import os
+import time
+import numpy as np
+from envi import INTERLEAVES
+
+
+class LineTail(object):
+    # file_name: raw file being written, need not exist yet
+    # samples, bands, interleave ('bil' or 'bip'), dtype, offset: layout
+    # block_lines: lines per block
+    # lines: lines of the whole capture, if known, the tail stops there
+    # idle_timeout: seconds without a new line after which the capture is
+    #               taken as finished, None to wait for `lines` (or stop())
+    # max_lag: blocks the consumer may fall behind before the oldest
+    #          waiting lines are skipped, None to never skip
+    # poll_interval: seconds between looks at the file size
+    def __init__(self, file_name, samples, bands, block_lines=16, interleave='bil', dtype=np.uint16,
+                 offset=0, lines=None, idle_timeout=None, max_lag=None, poll_interval=0.05):
+        interleave = interleave.lower()
+        if interleave not in ('bil', 'bip'):
+            raise ValueError('Only line interleaved (bil, bip) files can be read while written, not %s'
+                             % interleave)
+        self.file_name = file_name
+        self.samples = samples
+        self.bands = bands
+        self.block_lines = block_lines
+        self.dtype = np.dtype(dtype)
+        self.offset = offset
+        self.lines = lines
+        self.idle_timeout = idle_timeout
+        self.max_lag = max_lag
+        self.poll_interval = poll_interval
+
+        axes = INTERLEAVES[interleave]
+        self._line_shape = tuple((bands, None, samples)[a] for a in axes[1:])
+        self._to_cube = tuple(np.argsort(axes))
+        self._line_bytes = samples * bands * self.dtype.itemsize
+        self._stopped = False
+
+        # lines yielded so far and lines skipped because of max_lag
+        self.next_line = 0
+        self.dropped = 0
+
+    # complete lines in the file so far
+    def available(self):
+        try:
+            size = os.path.getsize(self.file_name)
+        except OSError:
+            return 0
+        n = max(size - self.offset, 0) // self._line_bytes
+        return n if self.lines is None else min(n, self.lines)
+
+    # complete lines waiting to be yielded
+    def lag(self):
+        return self.available() - self.next_line
+
+    # end the iteration after the current block
+    def stop(self):
+        self._stopped = True
+
+    # memmap of lines y to y + n, (bands, n, samples)
+    def _block(self, y, n):
+        block = np.memmap(self.file_name, dtype=self.dtype, mode='r',
+                          offset=self.offset + y * self._line_bytes,
+                          shape=(n,) + self._line_shape)
+        return np.transpose(block, self._to_cube)
+
+    # yields (first line, block) for every block_lines complete lines, then
+    # the last lines when the capture is over
+    def __iter__(self):
+        last_growth = time.time()
+        seen = -1
+        while not self._stopped:
+            available = self.available()
+            if available != seen:
+                seen = available
+                last_growth = time.time()
+
+            waiting = available - self.next_line
+            if self.max_lag is not None and waiting > self.max_lag * self.block_lines:
+                # keep only the newest max_lag blocks
+                skip = waiting - self.max_lag * self.block_lines
+                self.next_line += skip
+                self.dropped += skip
+                waiting -= skip
+
+            finished = (self.lines is not None and available >= self.lines) or \
+                (self.idle_timeout is not None and time.time() - last_growth > self.idle_timeout)
+            if waiting >= self.block_lines or (finished and waiting > 0):
+                n = min(waiting, self.block_lines)
+                y = self.next_line
+                self.next_line += n
+                yield y, self._block(y, n)
+            elif finished:
+                return
+            else:
+                time.sleep(self.poll_interval)
@@ -8,6 +8,7 @@ import skimage.data
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
 import ssModule
+import proposals
 import cv2
 import numpy as np
 
@@ -23,18 +24,12 @@ def ss_test():
     '''
     img = cv2.imread('hyperspectral_1bt.png')
     #img = cv2.imread('hs_img_0001.bmp')
-    img_lbl, regions = ssModule.selective_search(img, scale=500, sigma=0.9, min_size=10)
-
-    candidatas = set()
-    for r in regions:
-        if r['rect'] in candidatas:
-            continue
-        if r['size'] < 2000:
-            continue
-        x, y, w, h = r['rect']
-        if w/h > 1.2 or h/w > 1.2:
-            continue
-        candidatas.add(r['rect'])
+    img_lbl, (boxes, sizes) = ssModule.selective_search(img, scale=500, sigma=0.9, min_size=10,
+                                                        as_array=True)
+
+    # unique rects of at least 2000 pixels, no longer than 1.2 times their width
+    keep = proposals.select_proposals(boxes, sizes, min_size=2000, max_aspect=1.2)
+    candidatas = boxes[keep, :4].astype(int).tolist()
 
     fig, ax = plt.subplots(ncols=1, nrows=1, figsize=(6, 6))
     ax.imshow(img)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+'''
+Region proposals of selective search as arrays.
+
+A proposal array is (N, 5) float32, one row per region:
+    x, y, w, h, level
+(x, y, w, h) is the rect of the region dict, level orders the proposals, lower
+first: the position in the hierarchy (1 for the last region merged) for
+selective_search, the rank for selective_search_diversified.
+With as_array, the selective search functions give the pair (proposals,
+sizes) where they would give the region list.
+'''
+
+__author__ = 'smh'
+__date__ = '2018.10.19'
+
+import numpy as np
+
+
+# (N, 5) proposal array of rects (N, 4) and levels (N,)
+def to_array(rects, levels):
+    proposals = np.empty(shape=(len(rects), 5), dtype=np.float32)
+    proposals[:, :4] = rects
+    proposals[:, 4] = levels
+    return proposals
+
+
+# proposal array and sizes of no regions
+def no_proposals():
+    return to_array(np.zeros(shape=(0, 4)), np.zeros(0)), np.zeros(0, dtype=np.int64)
+
+
+# proposal array and sizes (N,) of every row of a grouped RegionTable, in row
+# order like RegionTable.regions(); level 1 is the last region merged
+def table_proposals(table):
+    n = len(table)
+    return to_array(table.rects(), np.arange(n, 0, -1)), table.size[:n].copy()
+
+
+# Indices of the proposals to keep, by increasing level:
+#   sizes, min_size: drop regions of fewer than min_size pixels
+#   max_aspect: drop rects with w / h or h / w above max_aspect
+#   nms_threshold: drop rects overlapping a kept rect by more than this IoU
+#   top_n: keep at most top_n proposals
+# Identical rects are kept once, at their lowest level.
+def select_proposals(proposals, sizes=None, min_size=0, max_aspect=None,
+                     nms_threshold=None, top_n=None):
+    x, y, w, h, level = proposals.T
+    keep = np.ones(len(proposals), dtype=bool)
+    if sizes is not None:
+        keep &= np.asarray(sizes) >= min_size
+    if max_aspect is not None:
+        keep &= (w <= max_aspect * h) & (h <= max_aspect * w)
+
+    candidates = np.flatnonzero(keep)
+    candidates = candidates[np.argsort(level[candidates], kind='stable')]
+    _, first = np.unique(proposals[candidates, :4], axis=0, return_index=True)
+    candidates = candidates[np.sort(first)]
+
+    if nms_threshold is None:
+        return candidates[:top_n]
+
+    x1 = x[candidates]
+    y1 = y[candidates]
+    x2 = x1 + w[candidates]
+    y2 = y1 + h[candidates]
+    area = w[candidates] * h[candidates]
+    order = np.arange(len(candidates))
+    selected = []
+    while len(order) and (top_n is None or len(selected) < top_n):
+        i = order[0]
+        selected.append(i)
+        rest = order[1:]
+        iw = np.maximum(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0)
+        ih = np.maximum(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0)
+        inter = iw * ih
+        union = area[i] + area[rest] - inter
+        iou = np.where(union > 0, inter / np.maximum(union, 1e-12), 0)
+        order = rest[iou <= nms_threshold]
+
+    return candidates[np.array(selected, dtype=np.int64)]
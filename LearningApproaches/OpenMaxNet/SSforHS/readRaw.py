@@ -7,33 +7,53 @@ No need to read the file as 12bit. just use np.float16 as dtype
 __author__ = 'smh'
 __date__ = '2018.08.22'
 
+import os
 import cv2
 
 dir = '/home/smher/Documents/Hyperspectrals/20180822/hs_img_datas_0001.raw'
 
-import numba as nb
 import numpy as np
+import envi
+from line_tail import LineTail
+try:
+    import numba as nb
+except ImportError:
+    # the 12 bit data is then unpacked by numpy, see unpack_uint12_into
+    nb = None
 
 
-@nb.njit(nb.uint16[::1](nb.uint8[::1]),fastmath=True,parallel=True)
-def nb_read_uint12(data_chunk):
-  """data_chunk is a contigous 1D array of uint8 data)
-  eg.data_chunk = np.frombuffer(data_chunk, dtype=np.uint8)"""
+if nb is not None:
+  @nb.njit(nb.uint16[::1](nb.uint8[::1]),fastmath=True,parallel=True)
+  def nb_read_uint12(data_chunk):
+    """data_chunk is a contigous 1D array of uint8 data)
+    eg.data_chunk = np.frombuffer(data_chunk, dtype=np.uint8)"""
 
-  #ensure that the data_chunk has the right length
-  assert np.mod(data_chunk.shape[0],3)==0
+    #ensure that the data_chunk has the right length
+    assert np.mod(data_chunk.shape[0],3)==0
 
-  out=np.empty(data_chunk.shape[0]//3*2,dtype=np.uint16)
+    out=np.empty(data_chunk.shape[0]//3*2,dtype=np.uint16)
 
-  for i in nb.prange(data_chunk.shape[0]//3):
-    fst_uint8=np.uint16(data_chunk[i*3])
-    mid_uint8=np.uint16(data_chunk[i*3+1])
-    lst_uint8=np.uint16(data_chunk[i*3+2])
+    for i in nb.prange(data_chunk.shape[0]//3):
+      fst_uint8=np.uint16(data_chunk[i*3])
+      mid_uint8=np.uint16(data_chunk[i*3+1])
+      lst_uint8=np.uint16(data_chunk[i*3+2])
 
-    out[i*2] =   (fst_uint8 << 4) + (mid_uint8 >> 4)
-    out[i*2+1] = ((mid_uint8 % 16) << 8) + lst_uint8
+      out[i*2] =   (fst_uint8 << 4) + (mid_uint8 >> 4)
+      out[i*2+1] = ((mid_uint8 % 16) << 8) + lst_uint8
 
-  return out
+    return out
+
+
+  # nb_read_uint12 into out (2 values per 3 bytes of data_chunk) instead of a new array
+  @nb.njit(nb.void(nb.uint8[::1], nb.uint16[::1]), fastmath=True, parallel=True, cache=True)
+  def nb_unpack_uint12_into(data_chunk, out):
+    for i in nb.prange(data_chunk.shape[0] // 3):
+      fst_uint8 = np.uint16(data_chunk[i * 3])
+      mid_uint8 = np.uint16(data_chunk[i * 3 + 1])
+      lst_uint8 = np.uint16(data_chunk[i * 3 + 2])
+
+      out[i * 2] = (fst_uint8 << 4) + (mid_uint8 >> 4)
+      out[i * 2 + 1] = ((mid_uint8 % 16) << 8) + lst_uint8
 
 
 def read_uint12(data_chunk):
@@ -45,41 +65,110 @@ def read_uint12(data_chunk):
     return np.reshape(np.concatenate((fst_uint12[:, None], snd_uint12[:, None]), axis=1), 2 * fst_uint12.shape[0])
 
 
-def read_12bit_raw_data(file_name, samples, lines, bands):
+# read_uint12 into out (2 values per 3 bytes of data_chunk) instead of a new array
+def unpack_uint12_into(data_chunk, out):
+    fst_uint8, mid_uint8, lst_uint8 = np.reshape(data_chunk, (-1, 3)).astype(np.uint16).T
+    out[0::2] = (fst_uint8 << 4) + (mid_uint8 >> 4)
+    out[1::2] = ((mid_uint8 % 16) << 8) + lst_uint8
+
+
+# Unpack the 12 bit values of file_name a chunk of chunk_bytes bytes (rounded
+# down to whole 3 byte groups) at a time, so only one chunk of packed data is
+# in memory besides the output.
+#   out: uint16 array (e.g. np.memmap) to unpack into, allocated if None
+#   count: bytes to unpack from the start of the file, all by default
+#   use_numba: unpack with nb_unpack_uint12_into, default when numba is there,
+#              else with unpack_uint12_into
+# Returns out, flattened.
+def read_12bit_stream(file_name, out=None, count=None, chunk_bytes=3 << 20, use_numba=nb is not None):
+    if use_numba and nb is None:
+        raise ImportError('use_numba needs numba, which is not installed')
+    if count is None:
+        count = os.path.getsize(file_name)
+    count -= count % 3
+    chunk_bytes = max(chunk_bytes - chunk_bytes % 3, 3)
+    if out is None:
+        out = np.empty(shape=count // 3 * 2, dtype=np.uint16)
+    if out.dtype != np.uint16 or not out.flags.c_contiguous:
+        raise ValueError('out must be a contiguous uint16 array')
+    flat = np.asarray(out).reshape(-1)
+    if len(flat) < count // 3 * 2:
+        raise ValueError('out holds %d values, %d bytes unpack to %d' % (len(flat), count, count // 3 * 2))
+    unpack = nb_unpack_uint12_into if use_numba else unpack_uint12_into
+
+    buffer = np.empty(shape=min(chunk_bytes, count), dtype=np.uint8)
     with open(file_name, 'rb') as fd:
-        rows = lines
-        cols = np.int(samples * bands * 2)
-        bin_img = np.fromfile(fd, dtype=np.uint8, count=rows * cols)
+        done = 0
+        while done < count:
+            n = fd.readinto(memoryview(buffer)[:min(chunk_bytes, count - done)])
+            n -= n % 3
+            if n == 0:
+                raise IOError('%s ends after %d of %d bytes' % (file_name, done, count))
+            unpack(buffer[:n], flat[done // 3 * 2:(done + n) // 3 * 2])
+            done += n
 
-    print('shape of bin_img: ', bin_img.shape)
-    data = nb_read_uint12(bin_img)
-    data = np.reshape(data, newshape=(lines, bands, -1))
+    return flat
+
+
+def read_12bit_raw_data(file_name, samples, lines, bands):
+    rows = lines
+    cols = int(samples * bands * 2)
+    data = read_12bit_stream(file_name, count=rows * cols)
+    print('shape of bin_img: ', (rows * cols,))
+    data = np.reshape(data, (lines, bands, -1))
 
     return np.transpose(data, axes=(1, 0, 2))
 
 
-def read_raw_data(file_name=dir, samples=696, lines=587, bands=128):
-    fd = open(file_name, 'rb')
-    rows = lines
-    cols = samples * bands
-    bin_img = np.fromfile(fd, dtype=np.uint16, count=rows * cols)
-    fd.close()
-    bin_img = np.reshape(bin_img, newshape=(lines, bands, samples))
-    img = np.transpose(bin_img, axes=(1, 2, 0))
+# layout of the sensor's raw files when they come without a .hdr
+SENSOR_LAYOUT = {'samples': 696, 'lines': 587, 'bands': 128, 'interleave': 'bil', 'data type': 12}
+
+
+# The cube of a raw file as a memmap view, nothing is read until it is indexed.
+# The layout comes from the .hdr of the file, where not given, see envi.
+def read_raw_data(file_name=dir, samples=None, lines=None, bands=None, interleave=None):
+    cube = envi.open_cube(file_name, samples, lines, bands, interleave, defaults=SENSOR_LAYOUT)
+    img = np.transpose(cube, axes=(0, 2, 1))
+
+    return img   # shape is: (bands, samples, lines), (128, 696, 587)
+
+
+# Follow a raw file while the sensor is still writing it, see line_tail.LineTail.
+# The layout is resolved like read_raw_data's: what is given, then the .hdr of
+# the file, then SENSOR_LAYOUT; lines, if not given, only from the .hdr.
+# Returns an iterator of (first line, block) for every block_lines new lines,
+# block is (bands, samples, block lines) like read_raw_data and still on disk.
+def tail_raw_data(file_name=dir, block_lines=16, samples=None, bands=None, interleave=None,
+                  lines=None, idle_timeout=5.0, max_lag=None):
+    hdr_name = envi.find_header(file_name)
+    header = envi.read_header(hdr_name) if hdr_name is not None else {}
+    fallback = dict(envi.DEFAULT_LAYOUT)
+    fallback.update(SENSOR_LAYOUT)
+
+    def pick(value, key):
+        if value is not None:
+            return value
+        return header.get(key, fallback.get(key))
+
+    samples = int(pick(samples, 'samples'))
+    bands = int(pick(bands, 'bands'))
+    interleave = str(pick(interleave, 'interleave')).lower()
+    if lines is None and 'lines' in header:
+        lines = int(header['lines'])
+    dtype = np.dtype(envi.DATA_TYPES[int(pick(None, 'data type'))])
+    dtype = dtype.newbyteorder('>' if int(pick(None, 'byte order')) else '<')
+    if interleave not in ('bil', 'bip'):
+        raise ValueError('%s is %s interleaved%s, only bil and bip files can be read while written'
+                         % (file_name, interleave, ' (%s)' % hdr_name if hdr_name is not None else ''))
 
-    return img   # shape is: (128, 587, 696)
+    tail = LineTail(file_name, samples, bands, block_lines, interleave, dtype=dtype,
+                    offset=int(pick(None, 'header offset')), lines=lines,
+                    idle_timeout=idle_timeout, max_lag=max_lag)
+    return ((y, np.transpose(block, axes=(0, 2, 1))) for y, block in tail)
 
 
 if __name__ == '__main__':
-    samples = 696
-    lines = 587
-    bands = 128
-    bin_img = read_raw_data(file_name=dir, samples=samples, lines=lines, bands=bands)
-    r = bin_img[55, :, :]
-    g = bin_img[85, :, :]
-    b = bin_img[93, :, :]
-    rgb = np.array([b, g, r])
-    rgb = rgb / np.max(rgb)
-    rgb = np.transpose(rgb, axes=(2, 1, 0))
+    # bands 55, 85 and 93 as r, g and b, BGR for cv2, read without the others
+    rgb = envi.read_preview(dir, (93, 85, 55), defaults=SENSOR_LAYOUT)
     cv2.imshow('Test', rgb)
     cv2.waitKey()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+'''
+Region information of selective search taken straight from the label map,
+shared by ssModule, ss_module and SelectiveSearch/ss_module_hs.
+'''
+
+__author__ = 'smh'
+__date__ = '2018.10.10'
+
+import numpy as np
+from collections import OrderedDict
+from region_table import RegionTable
+
+
+# Pairs of labels that touch horizontally or vertically in label_map.
+# Returns an (n, 2) int64 array of unique pairs, smaller label first.
+def extract_neighbours(label_map):
+    label_map = np.asarray(label_map).astype(np.int64)
+    a = np.concatenate([label_map[:, :-1].ravel(), label_map[:-1, :].ravel()])
+    b = np.concatenate([label_map[:, 1:].ravel(), label_map[1:, :].ravel()])
+    differ = a != b
+    a, b = a[differ], b[differ]
+
+    lo = np.minimum(a, b)
+    hi = np.maximum(a, b)
+    offset = lo.min() if len(lo) else 0
+    span = hi.max() - offset + 1 if len(hi) else 1
+    keys = np.unique((lo - offset) * span + (hi - offset))
+
+    return np.stack([keys // span + offset, keys % span + offset], axis=1)
+
+
+# Group the pixels of label_map by region, regions numbered in the order they
+# first appear in raster order (the order the per-pixel scan used to find them).
+# Returns (labels, ids): the label of every region and the (height * width)
+# region number of every pixel.
+def region_ids(label_map):
+    labels, first, ids = np.unique(np.ravel(label_map), return_index=True, return_inverse=True)
+    order = np.argsort(first, kind='stable')
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return labels[order], rank[ids.ravel()]
+
+
+# Bounding box and pixel count of every region, computed from the pixels
+# sorted by region. Returns (min_x, min_y, max_x, max_y, counts).
+def region_bounds(ids, n_regions, width):
+    counts = np.bincount(ids, minlength=n_regions)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    order = np.argsort(ids, kind='stable')
+    ys, xs = np.divmod(order, width)
+
+    # within a region the pixels stay in raster order, so y is already sorted
+    min_y = ys[starts]
+    max_y = ys[starts + counts - 1]
+    min_x = np.minimum.reduceat(xs, starts)
+    max_x = np.maximum.reduceat(xs, starts)
+
+    return min_x, min_y, max_x, max_y, counts
+
+
+# Histogram of every channel of values (height, width, channels) for every
+# region, binned like np.histogram(values, bins, value_range) and concatenated
+# over the channels. Returns an (n_regions, channels * bins) float64 count matrix.
+def region_histograms(ids, n_regions, values, bins, value_range):
+    hist = np.empty(shape=(n_regions, values.shape[-1] * bins), dtype=np.float64)
+    # byte codes (e.g. texture.lbp_cube) are binned through a table of all 256 codes
+    lut = None
+    if values.dtype == np.uint8:
+        lut = _bin_index(np.arange(256), bins, value_range)
+
+    for c in range(values.shape[-1]):
+        v = values[..., c].ravel()
+        b = lut[v] if lut is not None else _bin_index(v, bins, value_range)
+        inside = b >= 0
+        hist[:, c * bins:(c + 1) * bins] = np.bincount(
+            ids[inside] * bins + b[inside], minlength=n_regions * bins).reshape(n_regions, bins)
+
+    return hist
+
+
+# bin of each value as np.histogram(values, bins, value_range) counts it, -1 outside
+def _bin_index(values, bins, value_range):
+    lo, hi = value_range
+    b = ((values - lo) * (bins / float(hi - lo))).astype(np.int64)
+    # the last bin is closed like np.histogram's
+    b[b == bins] = bins - 1
+    b[(values < lo) | (values > hi)] = -1
+    return b
+
+
+# The RegionTable of selective search for label_map (height, width): bounding
+# box, size and the L1 normalised histograms "hist_c" and "hist_t" of the
+# channels of colour and texture (height, width, channels), if given.
+#   sizes: region sizes indexed by label, counted from label_map if None
+#   colour_bins, colour_range, texture_bins, texture_range: histogram binning
+def extract_regions(label_map, colour=None, texture=None, sizes=None,
+                    colour_bins=25, colour_range=(0.0, 255.0),
+                    texture_bins=10, texture_range=(0.0, 1.0)):
+    height, width = label_map.shape
+    labels, ids = region_ids(label_map)
+    n = len(labels)
+    min_x, min_y, max_x, max_y, counts = region_bounds(ids, n, width)
+
+    hists = OrderedDict()
+    for key, values, bins, value_range in (
+            ("hist_c", colour, colour_bins, colour_range),
+            ("hist_t", texture, texture_bins, texture_range)):
+        if values is not None:
+            hists[key] = region_histograms(ids, n, values, bins, value_range) / counts[:, np.newaxis]
+
+    if sizes is not None:
+        counts = np.asarray(sizes)[labels.astype(np.int64)]
+
+    return RegionTable(labels, min_x, min_y, max_x, max_y, counts, hists)
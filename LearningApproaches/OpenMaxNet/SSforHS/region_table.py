@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+'''
+Regions of selective search as a struct of arrays.
+
+Hierarchical grouping of n regions makes exactly n - 1 merges, so every array
+is allocated once with 2n - 1 rows: the initial regions first, then each
+merged region in the order it is made. Instead of a list of member labels, a
+merged region keeps the rows of the two regions it was made of; the labels
+are only collected by RegionTable.labels(row).
+'''
+
+__author__ = 'smh'
+__date__ = '2018.10.12'
+
+from collections import OrderedDict
+import numpy as np
+
+
+class RegionTable(object):
+    # labels: label of each initial region
+    # min_x, min_y, max_x, max_y, size: bounding box and pixel count of each
+    # initial region
+    # hists: dict of name -> (regions, bins) histogram matrix, e.g. "hist_t"
+    def __init__(self, labels, min_x, min_y, max_x, max_y, size, hists=None):
+        n = len(labels)
+        capacity = max(2 * n - 1, 0)
+        self.n_leaves = n
+        self.n = n
+        self.leaf_labels = np.asarray(labels)
+
+        def column(values, dtype):
+            out = np.zeros(shape=(capacity,) + np.shape(values)[1:], dtype=dtype)
+            out[:n] = values
+            return out
+
+        self.min_x = column(min_x, np.int64)
+        self.min_y = column(min_y, np.int64)
+        self.max_x = column(max_x, np.int64)
+        self.max_y = column(max_y, np.int64)
+        self.size = column(size, np.int64)
+        self.hists = OrderedDict()
+        for name, hist in (hists or {}).items():
+            self.hists[name] = column(hist, np.float64)
+
+        # merge tree, -1 for none
+        self.parent = np.full(capacity, -1, dtype=np.int64)
+        self.children = np.full((capacity, 2), -1, dtype=np.int64)
+
+    def __len__(self):
+        return self.n
+
+    # rows of the initial regions with the given labels, KeyError for a label
+    # that is not one of them
+    def rows(self, labels):
+        labels = np.asarray(labels)
+        order = np.argsort(self.leaf_labels, kind='stable')
+        found = np.searchsorted(self.leaf_labels[order], labels)
+        missing = found >= len(order)
+        if len(order) == 0:
+            rows = found
+        else:
+            rows = order[np.where(missing, 0, found)]
+            missing |= self.leaf_labels[rows] != labels
+        if np.any(missing):
+            raise KeyError(labels[missing].ravel()[0].item())
+        return rows
+
+    # add the region made of rows i and j, returns its row
+    def merge(self, i, j):
+        t = self.n
+        self.min_x[t] = min(self.min_x[i], self.min_x[j])
+        self.min_y[t] = min(self.min_y[i], self.min_y[j])
+        self.max_x[t] = max(self.max_x[i], self.max_x[j])
+        self.max_y[t] = max(self.max_y[i], self.max_y[j])
+        self.size[t] = self.size[i] + self.size[j]
+        for hist in self.hists.values():
+            hist[t] = (hist[i] * self.size[i] + hist[j] * self.size[j]) / self.size[t]
+
+        self.children[t] = (i, j)
+        self.parent[i] = t
+        self.parent[j] = t
+        self.n += 1
+        return t
+
+    # rows of the initial regions under row, first child's first
+    def members(self, row):
+        leaves = []
+        stack = [row]
+        while stack:
+            r = stack.pop()
+            if r < self.n_leaves:
+                leaves.append(r)
+            else:
+                stack.append(self.children[r, 1])
+                stack.append(self.children[r, 0])
+        return np.array(leaves, dtype=np.int64)
+
+    # labels of the initial regions under row, as a list
+    def labels(self, row):
+        return self.leaf_labels[self.members(row)].tolist()
+
+    # (left, top, width, height) of row
+    def rect(self, row):
+        return (int(self.min_x[row]), int(self.min_y[row]),
+                int(self.max_x[row] - self.min_x[row]), int(self.max_y[row] - self.min_y[row]))
+
+    # (left, top, width, height) of every row, (n, 4) int64
+    def rects(self):
+        n = self.n
+        return np.stack([self.min_x[:n], self.min_y[:n],
+                         self.max_x[:n] - self.min_x[:n], self.max_y[:n] - self.min_y[:n]], axis=1)
+
+    # the region list selective_search returns
+    def regions(self):
+        return [{'rect': self.rect(r), 'size': int(self.size[r]), 'labels': self.labels(r)}
+                for r in range(self.n)]
+
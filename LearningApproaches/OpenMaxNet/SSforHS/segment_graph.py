@@ -1,5 +1,6 @@
 from disjoint_set import *
 import numpy as np
+import numba as nb
 import random
 
 
@@ -9,37 +10,95 @@ import random
 #
 # Inputs:
 #           num_vertices: number of vertices in graph.
-#           num_edges: number of edges in graph
-#           edges: array of edges.
+#           edges_a, edges_b: int32 endpoints of each edge.
+#           edges_w: float32 weight of each edge.
 #           c: constant for threshold function.
 #
 # Output:
 #           a disjoint-set forest representing the segmentation.
+#           the edge arrays are sorted by weight in place.
 # ------------------------------------------------------------
-def segment_graph(num_vertices, num_edges, edges, c):
-    # sort edges by weight (3rd column)
-    edges[0:num_edges, :] = edges[edges[0:num_edges, 2].argsort()]
+def segment_graph(num_vertices, edges_a, edges_b, edges_w, c):
+    # sort edges by weight
+    sort_edges(edges_a, edges_b, edges_w)
+    return segment_sorted(num_vertices, edges_a, edges_b, edges_w, c)
+
+
+# segment_graph for edges already sorted by weight, which are left unchanged
+def segment_sorted(num_vertices, edges_a, edges_b, edges_w, c):
     # make a disjoint-set forest
     u = universe(num_vertices)
     # init thresholds
-    threshold = np.zeros(shape=num_vertices, dtype=float)
-    for i in range(num_vertices):
-        threshold[i] = get_threshold(1, c)
+    threshold = np.full(num_vertices, get_threshold(1, c), dtype=float)
 
     # for each edge, in non-decreasing weight order...
-    for i in range(num_edges):
-        pedge = edges[i, :]
+    u.num -= segment_edges(u.p, u.rank, u.sz, threshold, edges_a, edges_b, edges_w, c)
+
+    return u
+
+
+# sort the edge arrays by weight in place
+def sort_edges(edges_a, edges_b, edges_w):
+    order = edges_w.argsort()
+    edges_a[:] = edges_a[order]
+    edges_b[:] = edges_b[order]
+    edges_w[:] = edges_w[order]
+
+
+# join the components of u connected by an edge if either of them is
+# smaller than min_size, visiting the edges in the given order.
+def merge_small_components(u, edges_a, edges_b, min_size):
+    u.num -= merge_small_edges(u.p, u.rank, u.sz, edges_a, edges_b, min_size)
+    return u
+
+
+# number the components of u 0..K-1 in one pass.
+# Returns the int32 component label of every element and the size of each component.
+def component_labels(u):
+    roots = find_all(u.p)
+    is_root = roots == np.arange(len(roots))
+    root_labels = np.cumsum(is_root, dtype=np.int32) - 1
+    return root_labels[roots], u.sz[is_root]
+
+
+@nb.njit(cache=True)
+def find_all(p):
+    roots = np.empty_like(p)
+    for i in range(len(p)):
+        roots[i] = find_set(p, i)
+    return roots
+
+
+# Felzenszwalb merge pass over edges sorted by weight.
+# Returns the number of joins.
+@nb.njit(cache=True)
+def segment_edges(p, rank, size, threshold, edges_a, edges_b, edges_w, c):
+    joins = 0
+    for i in range(len(edges_w)):
+        w = edges_w[i]
 
         # components connected by this edge
-        a = u.find(pedge[0])
-        b = u.find(pedge[1])
+        a = find_set(p, edges_a[i])
+        b = find_set(p, edges_b[i])
         if a != b:
-            if (pedge[2] <= threshold[a]) and (pedge[2] <= threshold[b]):
-                u.join(a, b)
-                a = u.find(a)
-                threshold[a] = pedge[2] + get_threshold(u.size(a), c)
+            if (w <= threshold[a]) and (w <= threshold[b]):
+                join_sets(p, rank, size, a, b)
+                a = find_set(p, a)
+                threshold[a] = w + c / size[a]
+                joins += 1
+    return joins
 
-    return u
+
+@nb.njit(cache=True)
+def merge_small_edges(p, rank, size, edges_a, edges_b, min_size):
+    joins = 0
+    for i in range(len(edges_a)):
+        a = find_set(p, edges_a[i])
+        b = find_set(p, edges_b[i])
+        if (a != b) and ((size[a] < min_size) or (size[b] < min_size)):
+            join_sets(p, rank, size, a, b)
+            joins += 1
+    return joins
 
 
 def get_threshold(size, c):
@@ -6,200 +6,106 @@ __date__ = '2018.09.19'
 
 import numpy as np
 import graphSeg
-import skimage.feature
+import texture
 import readRaw
+import envi
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
 import time
 import joblib
+import grouping
+import region_stats
+import proposals
 
 
-def _generate_segments(im_orig, scale, sigma, min_size):
+# key: graphSeg.cube_key of im_orig, computed here when not given
+def _generate_segments(im_orig, scale, sigma, min_size, key=None):
     h, w, c = im_orig.shape
-    im_mask = graphSeg.segment_hs(im_orig, sigma, scale, min_size)
+    # the smoothed and sorted graph is shared between calls on the same cube
+    im_mask, sizes = graphSeg.get_context(im_orig, sigma, key=key).segment(scale, min_size)
     print('shape of im_mask: ', im_mask.shape)
     im_orig = np.transpose(im_orig, axes=(1, 2, 0))
     im_orig = np.append(im_orig, np.zeros(im_orig.shape[:2])[:, :, np.newaxis], axis=2)
     im_orig[:, :, -1] = im_mask
 
-    return im_orig
+    return im_orig, sizes
 
 
-def _sim_texture(r1, r2):
-    return sum([min(a, b) for a, b in zip(r1["hist_t"], r2["hist_t"])])
+def _sim_texture(table, i, j):
+    hist = table.hists["hist_t"]
+    return np.minimum(hist[i], hist[j]).sum(axis=-1)
 
 
-def _sim_size(r1, r2, imsize):
-    return 1.0 - (r1["size"] + r2["size"]) / imsize
+def _sim_size(table, i, j, imsize):
+    return 1.0 - (table.size[i] + table.size[j]) / imsize
 
 
-def _sim_fill(r1, r2, imsize):
+def _sim_fill(table, i, j, imsize):
     bbsize = (
-            (max(r1["max_x"], r2["max_x"]) - min(r1["min_x"], r2["min_x"]))
-            * (max(r1["max_y"], r2["max_y"]) - min(r1["min_y"], r2["min_y"]))
+            (np.maximum(table.max_x[i], table.max_x[j]) - np.minimum(table.min_x[i], table.min_x[j]))
+            * (np.maximum(table.max_y[i], table.max_y[j]) - np.minimum(table.min_y[i], table.min_y[j]))
     )
-    return 1.0 - (bbsize - r1["size"] - r2["size"]) / imsize
+    return 1.0 - (bbsize - table.size[i] - table.size[j]) / imsize
 
 
-def _calc_sim(r1, r2, imsize):
-    return (_sim_texture(r1, r2)
-            + _sim_size(r1, r2, imsize) + _sim_fill(r1, r2, imsize))
+# similarity of rows i and j of the region table, element-wise when i or j
+# is an array of rows
+def _calc_sim(table, i, j, imsize):
+    return (_sim_texture(table, i, j)
+            + _sim_size(table, i, j, imsize) + _sim_fill(table, i, j, imsize))
 
 
-def _calc_texture_gradient(img):
-    ret = np.zeros((img.shape[0], img.shape[1], img.shape[2]))
+# LBP codes of every band of img (the label channel excluded), as uint8,
+# coded in this process or by n_workers processes, see texture.lbp_cube
+def _calc_texture_gradient(img, n_workers=1):
+    return texture.lbp_cube(img[:, :, :-1], n_workers)
 
-    for colour_channel in range(img.shape[2]):
-        # local_binary_pattern: gray scale and rotation invariant LBP
-        # LBP is an invariant descriptor that can be used for texture classification
-        ret[:, :, colour_channel] = skimage.feature.local_binary_pattern(
-            img[:, :, colour_channel], 8, 1.0
-        )
 
-    return ret
+# Input: img.shape = (696, 587, 129)
+def _extract_region(img, sizes, n_workers=1):
+    tex_grad = _calc_texture_gradient(img, n_workers)
 
+    # Only calculate texture histogram, No colour histogram is used here
+    return region_stats.extract_regions(img[:, :, -1], texture=tex_grad, sizes=sizes)
 
-def _calc_texture_hist(img):
-    BINS = 10
-    hist = np.array([])
-    for colour_channel in range(img.shape[1] - 1):
-        fd = img[:, colour_channel]
 
-        hist = np.concatenate([hist] + [np.histogram(fd, BINS, (0.0, 1.0))[0]])
-    hist = hist / len(img)
+# pairs of region labels touching in the label map, see region_stats
+def _extract_neighbours(img):
+    return region_stats.extract_neighbours(img[:, :, -1])
 
-    return hist
 
+# merge the most similar neighbouring regions of R until one is left,
+# adding every merged region to R
+def _hierarchical_grouping(R, neighbours, imsize):
+    return grouping.hierarchical_grouping(
+        R, neighbours, lambda table, i, j: _calc_sim(table, i, j, imsize))
 
-# Input: img.shape = (696, 587, 129)
-def _extract_region(img):
-    R = {}
-
-    # pass 1: count pixel positions
-    for y, i in enumerate(img):
-        # i.shape = (587, 129)
-        for x, spectum in enumerate(i):
-            #band = spectum[:, :-1]
-            # spectum.shape = (129)
-            l = spectum[-1]
-
-            if l not in R:
-                R[l] = {"min_x":0xffff, "min_y":0xffff,
-                        "max_x":0, "max_y":0, "labels":[l]}
-
-            # bounding box
-            if R[l]["min_x"] > x:
-                R[l]["min_x"] = x
-            if R[l]["min_y"] > y:
-                R[l]["min_y"] = y
-            if R[l]["max_x"] < x:
-                R[l]["max_x"] = x
-            if R[l]["max_y"] < y:
-                R[l]["max_y"] = y
-
-    # pass 2: calculate texture gradient
-    tex_grad = _calc_texture_gradient(img)
-    print('tex_grad shape: ', tex_grad.shape)   # (696, 587, 129)
-
-    for k, v in R.items():
-        masked_pixels = img[:, :, :-1][img[:, :, -1] == k]
-        print('shape of masked_pixels: ', masked_pixels.shape)
-        R[k]["size"] = len(masked_pixels / 4)
-        # Only calculate texture histogram, No colour histogram is used here
-        R[k]["hist_t"] = _calc_texture_hist(tex_grad[:, :][img[:, :, -1] == k])
-
-    return R
-
-
-def _extract_neighbours(regions):
-    def intersect(a, b):
-        if (a["min_x"] < b["min_x"] < a["max_x"]
-            and a["min_y"] < b["min_y"] < a["max_y"]) or (
-                a["min_x"] < b["max_x"] < a["max_x"]
-                and a["min_y"] < b["max_y"] < a["max_y"]) or (
-                a["min_x"] < b["min_x"] < a["max_x"]
-                and a["min_y"] < b["max_y"] < a["max_y"]) or (
-                a["min_x"] < b["max_x"] < a["max_x"]
-                and a["min_y"] < b["min_y"] < a["max_y"]):
-            return True
-        return False
-
-    R = list(regions.items())
-    neighbours = []
-    for cur, a in enumerate(R[:-1]):
-        for b in R[cur+1 :]:
-            if intersect(a[1], b[1]):
-                neighbours.append((a, b))
-
-    return neighbours
-
-
-def _merge_regions(r1, r2):
-    new_size = r1["size"] + r2["size"]
-    rt = {
-        "min_x": min(r1["min_x"], r2["min_x"]),
-        "min_y": min(r1["min_y"], r2["min_y"]),
-        "max_x": max(r1["max_x"], r2["max_x"]),
-        "max_y": max(r1["max_y"], r2["max_y"]),
-        "size": new_size,
-        "hist_t": (
-                          r1["hist_t"] * r1["size"] + r2["hist_t"] * r2["size"]) / new_size,
-        "labels": r1["labels"] + r2["labels"]
-    }
-    return rt
-
-
-def selective_search(im_orig, scale=1.0, sigma=0.8, min_size=500):
+
+# (img, regions): regions as dicts, or as_array the pair (proposal array,
+# sizes), see proposals
+# key: graphSeg.cube_key of im_orig, for a cube in memory segmented many times
+def selective_search(im_orig, scale=1.0, sigma=0.8, min_size=500, n_workers=1, as_array=False, key=None):
     start = time.time()
-    img = _generate_segments(im_orig, scale, sigma, min_size)
-    print('generate_segments timing: ', time.time() - start)   # 477.603767s
-    print('img shape: ', img.shape)    # (696, 587, 129)
+    img, sizes = _generate_segments(im_orig, scale, sigma, min_size, key)
+    print('generate_segments timing: ', time.time() - start)
     if img is None:
-        return None, {}
+        return None, proposals.no_proposals() if as_array else []
+    print('img shape: ', img.shape)    # (696, 587, 129)
 
     imsize = img.shape[0] * img.shape[1]
-    R = _extract_region(img)
-    print('extract regions timing: ', time.time() - start)  # 486.635149s
-
-    neighbours = _extract_neighbours(R)
-    print('extract neighbours timing: ', time.time() - start)  # 486.63590s
-
-    S = {}
-    for (ai, ar), (bi, br) in neighbours:
-        S[(ai, bi)] = _calc_sim(ar, br, imsize)
-    print('calculate similarities timing: ', time.time() - start)  # 486.77842s
-
-    while S != {}:
-        i, j = sorted(S.items(), key=lambda i : i[1])[-1][0]
-        t = max(R.keys()) + 1.0
-        R[t] = _merge_regions(R[i], R[j])
-
-        key_to_delete = []
-        # mark similarities for regions to be removed
-        for k, v in S.items():
-            if (i in k) or (j in k):
-                key_to_delete.append(k)
-
-        # remove old similarities of related regions
-        for k in key_to_delete:
-            del S[k]
-
-        # calculate similarity set with the new region
-        for k in filter(lambda a: a != (i, j), key_to_delete):
-            n = k[1] if k[0] in (i, j) else k[0]
-            S[(t, n)] = _calc_sim(R[t], R[n], imsize)
-
-    print('merge regions timing: ', time.time() - start)  # 487.19150s
-    regions = []
-    for k, r in R.items():
-        regions.append({
-            'rect': (
-                r['min_x'], r['min_y'],
-                r['max_x'] - r['min_x'], r['max_y'] - r['min_y']),
-            'size': r['size'],
-            'labels': r['labels']
-        })
-    print('Total ss timing: ', time.time() - start)  # 487.19157s
+    R = _extract_region(img, sizes, n_workers)
+    print('extract regions timing: ', time.time() - start)
+
+    neighbours = _extract_neighbours(img)
+    R = _hierarchical_grouping(R, neighbours, imsize)
+    print('merge regions timing: ', time.time() - start)
+    if as_array:
+        regions = proposals.table_proposals(R)
+        print('Total ss timing: ', time.time() - start)
+        return img, regions
+
+    regions = R.regions()
+    print('Total ss timing: ', time.time() - start)
 
     return img, regions
 
@@ -207,29 +113,13 @@ def selective_search(im_orig, scale=1.0, sigma=0.8, min_size=500):
 def ss_test():
     im_orig = readRaw.read_raw_data()
     print('im_orig shape: ', im_orig.shape)   # (128, 696, 587)
-    img_lbl, regions = selective_search(im_orig)
-    candidatas = set()
-    for r in regions:
-        if r['rect'] in candidatas:
-            continue
-        if r['size'] < 2000:
-            continue
-        x, y, w, h = r['rect']
-        if w/h > 1.2 or h/w > 1.2:
-            continue
-
-        candidatas.add(r['rect'])
+    img_lbl, (boxes, sizes) = selective_search(im_orig, as_array=True)
+    # unique rects of at least 2000 pixels, no longer than 1.2 times their width
+    keep = proposals.select_proposals(boxes, sizes, min_size=2000, max_aspect=1.2)
+    candidatas = set(map(tuple, boxes[keep, :4].astype(int).tolist()))
 
     fig, ax = plt.subplots(ncols=1, nrows=1, figsize=(6, 6))
-    r = im_orig[55, :, :]
-    g = im_orig[85, :, :]
-    b = im_orig[93, :, :]
-    rgb = np.array([b, g, r])
-    rgb = rgb.astype('float32')
-    img = np.transpose(rgb, axes=(1, 2, 0))
-    img /= np.max(img)
-    img *= 255
-    img = img.astype(np.uint8)
+    img = envi.rgb_preview(im_orig, (93, 85, 55))
     print('max value of img: ', np.max(img))
     joblib.dump(img, 'img.joblib')
     joblib.dump(candidatas, 'candidaates.joblib')
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+'''
+LBP texture codes of every band of a hyperspectral image for selective search.
+
+With 8 sampling points the codes fit in a byte, so they are kept as uint8
+instead of the float64 skimage returns, which is an eighth of the memory.
+The bands are coded a block at a time, optionally in a pool of processes.
+'''
+
+__author__ = 'smh'
+__date__ = '2018.10.15'
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import multiprocessing
+import os
+import numpy as np
+import skimage.feature
+
+
+# LBP codes of each band of block (height, width, bands), as uint8
+def _lbp_block(block, points, radius):
+    codes = np.empty(shape=block.shape, dtype=np.uint8)
+    for c in range(block.shape[2]):
+        codes[:, :, c] = skimage.feature.local_binary_pattern(block[:, :, c], points, radius)
+    return codes
+
+
+# LBP codes of every band of cube (height, width, bands), as uint8.
+# The bands are split into blocks of `block` bands coded in this process by
+# default. With n_workers > 1 (None for all cores) they are coded by a pool of
+# that many spawned processes, with at most 2 * n_workers blocks in flight;
+# starting the pool costs seconds, so it only pays off on large cubes, and
+# not inside a pool already busy on other cubes (batch, diversify).
+def lbp_cube(cube, n_workers=1, points=8, radius=1.0, block=8):
+    if points > 8:
+        raise ValueError('LBP codes of %d points do not fit in uint8' % points)
+    height, width, bands = cube.shape
+    codes = np.empty(shape=(height, width, bands), dtype=np.uint8)
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    if n_workers <= 1:
+        for c in range(0, bands, block):
+            codes[:, :, c:c + block] = _lbp_block(cube[:, :, c:c + block], points, radius)
+        return codes
+
+    # spawned like the tile workers of graphSeg, numba's threads do not survive a fork
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        pending = {}
+        for c in range(0, bands, block):
+            bands_in = np.ascontiguousarray(cube[:, :, c:c + block])
+            pending[pool.submit(_lbp_block, bands_in, points, radius)] = c
+            if len(pending) >= 2 * n_workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    c0 = pending.pop(future)
+                    codes[:, :, c0:c0 + block] = future.result()
+        for future in list(pending):
+            c0 = pending.pop(future)
+            codes[:, :, c0:c0 + block] = future.result()
+
+    return codes
@@ -3,6 +3,11 @@
 __author__ = 'smh'
 __date__ = '2018.08.29'
 
+import os
+import sys
+# grouping lives in SSforHS
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SSforHS'))
+
 import skimage.io
 import skimage.feature
 import skimage.color
@@ -10,6 +15,10 @@ import skimage.transform
 import skimage.util
 import skimage.segmentation
 import numpy
+import grouping
+import region_stats
+import diversify
+import proposals
 
 
 # "Selective Search for Object Recognition" by J.R.R. Uijlings et al.
@@ -17,6 +26,13 @@ import numpy
 #  - Modified version with LBP extractor for texture vectorization
 
 
+# similarity measures _calc_sim can combine
+SIMILARITIES = ('colour', 'texture', 'size', 'fill')
+
+# colour spaces _calc_colour can convert to
+COLOUR_SPACES = ('hsv', 'lab', 'rgi', 'rgb')
+
+
 def _generate_segments(im_orig, scale, sigma, min_size):
     """
         segment smallest regions by the algorithm of Felzenswalb and
@@ -36,70 +52,79 @@ def _generate_segments(im_orig, scale, sigma, min_size):
     return im_orig
 
 
-def _sim_colour(r1, r2):
+def _sim_colour(table, i, j):
     """
         calculate the sum of histogram intersection of colour
     """
-    return sum([min(a, b) for a, b in zip(r1["hist_c"], r2["hist_c"])])
+    hist = table.hists["hist_c"]
+    return numpy.minimum(hist[i], hist[j]).sum(axis=-1)
 
 
-def _sim_texture(r1, r2):
+def _sim_texture(table, i, j):
     """
         calculate the sum of histogram intersection of texture
     """
-    return sum([min(a, b) for a, b in zip(r1["hist_t"], r2["hist_t"])])
+    hist = table.hists["hist_t"]
+    return numpy.minimum(hist[i], hist[j]).sum(axis=-1)
 
 
-def _sim_size(r1, r2, imsize):
+def _sim_size(table, i, j, imsize):
     """
         calculate the size similarity over the image
     """
-    return 1.0 - (r1["size"] + r2["size"]) / imsize
+    return 1.0 - (table.size[i] + table.size[j]) / imsize
 
 
-def _sim_fill(r1, r2, imsize):
+def _sim_fill(table, i, j, imsize):
     """
         calculate the fill similarity over the image
     """
     bbsize = (
-            (max(r1["max_x"], r2["max_x"]) - min(r1["min_x"], r2["min_x"]))
-            * (max(r1["max_y"], r2["max_y"]) - min(r1["min_y"], r2["min_y"]))
+            (numpy.maximum(table.max_x[i], table.max_x[j]) - numpy.minimum(table.min_x[i], table.min_x[j]))
+            * (numpy.maximum(table.max_y[i], table.max_y[j]) - numpy.minimum(table.min_y[i], table.min_y[j]))
     )
-    return 1.0 - (bbsize - r1["size"] - r2["size"]) / imsize
+    return 1.0 - (bbsize - table.size[i] - table.size[j]) / imsize
 
 
-def _calc_sim(r1, r2, imsize):
-    return (_sim_colour(r1, r2) + _sim_texture(r1, r2)
-            + _sim_size(r1, r2, imsize) + _sim_fill(r1, r2, imsize))
-
-
-def _calc_colour_hist(img):
+def _calc_sim(table, i, j, imsize, similarities=SIMILARITIES):
     """
-        calculate colour histogram for each region
-
-        the size of output histogram will be BINS * COLOUR_CHANNELS(3)
-
-        number of bins is 25 as same as [uijlings_ijcv2013_draft.pdf]
-
-        extract HSV
+        similarity of rows i and j of the region table, element-wise when
+        i or j is an array of rows, summed over the measures in similarities
     """
+    sim = 0.0
+    if 'colour' in similarities:
+        sim = sim + _sim_colour(table, i, j)
+    if 'texture' in similarities:
+        sim = sim + _sim_texture(table, i, j)
+    if 'size' in similarities:
+        sim = sim + _sim_size(table, i, j, imsize)
+    if 'fill' in similarities:
+        sim = sim + _sim_fill(table, i, j, imsize)
+    return sim
+
+
+def _calc_colour(img, colour_space='hsv'):
+    """
+        convert the rgb channels of img for the colour histogram, which bins
+        over (0, 255)
 
-    BINS = 25
-    hist = numpy.array([])
-
-    for colour_channel in (0, 1, 2):
-
-        # extracting one colour channel
-        c = img[:, colour_channel]
-
-        # calculate histogram for each colour and join to the result
-        hist = numpy.concatenate(
-            [hist] + [numpy.histogram(c, BINS, (0.0, 255.0))[0]])
-
-    # L1 normalize
-    hist = hist / len(img)
-
-    return hist
+        hsv is taken as skimage.color gives it, lab and rgi (normalised r, g
+        and intensity) are scaled to (0, 255)
+    """
+    rgb = img[:, :, :3]
+    if colour_space == 'hsv':
+        return skimage.color.rgb2hsv(rgb)
+    if colour_space == 'rgb':
+        return rgb.astype(numpy.float64)
+    if colour_space == 'lab':
+        lab = skimage.color.rgb2lab(rgb.astype(numpy.uint8))
+        return numpy.dstack([lab[:, :, 0] * 2.55, lab[:, :, 1] + 128.0, lab[:, :, 2] + 128.0])
+    if colour_space == 'rgi':
+        rgb = rgb.astype(numpy.float64)
+        total = numpy.maximum(rgb.sum(axis=2), 1e-6)
+        return numpy.dstack([rgb[:, :, 0] / total * 255.0, rgb[:, :, 1] / total * 255.0,
+                             rgb.sum(axis=2) / 3.0])
+    raise ValueError('Unknown colour space: %s' % colour_space)
 
 
 def _calc_texture_gradient(img):
@@ -120,122 +145,56 @@ def _calc_texture_gradient(img):
     return ret
 
 
-def _calc_texture_hist(img):
+def _extract_regions(img, colour_space='hsv'):
     """
-        calculate texture histogram for each region
-
-        calculate the histogram of gradient for each colours
-        the size of output histogram will be
-            BINS * ORIENTATIONS * COLOUR_CHANNELS(3)
+        bounding box, size, colour histogram (25 bins per channel of
+        colour_space) and texture histogram (10 bins per colour channel) of
+        every region, all taken in one pass over the label map by region_stats
     """
-    BINS = 10
-
-    hist = numpy.array([])
-
-    for colour_channel in (0, 1, 2):
-
-        # mask by the colour channel
-        fd = img[:, colour_channel]
-
-        # calculate histogram for each orientation and concatenate them all
-        # and join to the result
-        hist = numpy.concatenate(
-            [hist] + [numpy.histogram(fd, BINS, (0.0, 1.0))[0]])
 
-    # L1 Normalize
-    hist = hist / len(img)
+    # get hsv image (or the colour space of the strategy)
+    colour = _calc_colour(img, colour_space)
 
-    return hist
+    # calculate texture gradient
+    tex_grad = _calc_texture_gradient(img)
 
+    return region_stats.extract_regions(
+        img[:, :, 3], colour=colour, texture=tex_grad[:, :, :3])
 
-def _extract_regions(img):
 
-    R = {}
+# pairs of region labels touching in the label map, see region_stats
+def _extract_neighbours(img):
+    return region_stats.extract_neighbours(img[:, :, 3])
 
-    # get hsv image
-    hsv = skimage.color.rgb2hsv(img[:, :, :3])
 
-    # pass 1: count pixel positions
-    for y, i in enumerate(img):
+def _group_regions(img, colour_space='hsv', similarities=SIMILARITIES):
+    """
+        RegionTable of the hierarchy of img (with the region label channel)
+        for one strategy
+    """
+    imsize = img.shape[0] * img.shape[1]
+    R = _extract_regions(img, colour_space)
 
-        for x, (r, g, b, l) in enumerate(i):
+    # extract neighbouring information
+    neighbours = _extract_neighbours(img)
 
-            # initialize a new region
-            if l not in R:
-                R[l] = {
-                    "min_x": 0xffff, "min_y": 0xffff,
-                    "max_x": 0, "max_y": 0, "labels": [l]}
+    # hierarchal search
+    return grouping.hierarchical_grouping(
+        R, neighbours, lambda table, i, j: _calc_sim(table, i, j, imsize, similarities))
 
-            # bounding box
-            if R[l]["min_x"] > x:
-                R[l]["min_x"] = x
-            if R[l]["min_y"] > y:
-                R[l]["min_y"] = y
-            if R[l]["max_x"] < x:
-                R[l]["max_x"] = x
-            if R[l]["max_y"] < y:
-                R[l]["max_y"] = y
 
-    # pass 2: calculate texture gradient
-    tex_grad = _calc_texture_gradient(img)
-
-    # pass 3: calculate colour histogram of each region
-    for k, v in R.items():
-
-        # colour histogram
-        masked_pixels = hsv[:, :, :][img[:, :, 3] == k]
-        R[k]["size"] = len(masked_pixels / 4)
-        R[k]["hist_c"] = _calc_colour_hist(masked_pixels)
-
-        # texture histogram
-        R[k]["hist_t"] = _calc_texture_hist(tex_grad[:, :][img[:, :, 3] == k])
-
-    return R
-
-
-def _extract_neighbours(regions):
-
-    def intersect(a, b):
-        if (a["min_x"] < b["min_x"] < a["max_x"]
-            and a["min_y"] < b["min_y"] < a["max_y"]) or (
-                a["min_x"] < b["max_x"] < a["max_x"]
-                and a["min_y"] < b["max_y"] < a["max_y"]) or (
-                a["min_x"] < b["min_x"] < a["max_x"]
-                and a["min_y"] < b["max_y"] < a["max_y"]) or (
-                a["min_x"] < b["max_x"] < a["max_x"]
-                and a["min_y"] < b["min_y"] < a["max_y"]):
-            return True
-        return False
-
-    R = list(regions.items())
-    neighbours = []
-    for cur, a in enumerate(R[:-1]):
-        for b in R[cur + 1:]:
-            if intersect(a[1], b[1]):
-                neighbours.append((a, b))
-
-    return neighbours
-
-
-def _merge_regions(r1, r2):
-    new_size = r1["size"] + r2["size"]
-    rt = {
-        "min_x": min(r1["min_x"], r2["min_x"]),
-        "min_y": min(r1["min_y"], r2["min_y"]),
-        "max_x": max(r1["max_x"], r2["max_x"]),
-        "max_y": max(r1["max_y"], r2["max_y"]),
-        "size": new_size,
-        "hist_c": (
-                          r1["hist_c"] * r1["size"] + r2["hist_c"] * r2["size"]) / new_size,
-        "hist_t": (
-                          r1["hist_t"] * r1["size"] + r2["hist_t"] * r2["size"]) / new_size,
-        "labels": r1["labels"] + r2["labels"]
-    }
-    return rt
+def _run_strategy(im_orig, colour_space, similarities, scale, sigma, min_size):
+    """
+        rects and sizes of the hierarchy of one diversification strategy,
+        run in a worker of selective_search_diversified
+    """
+    img = _generate_segments(im_orig, scale, sigma, min_size)
+    R = _group_regions(img, colour_space, similarities)
+    return R.rects(), R.size[:len(R)].copy()
 
 
 def selective_search(
-        im_orig, scale=1.0, sigma=0.8, min_size=50):
+        im_orig, scale=1.0, sigma=0.8, min_size=50, as_array=False):
     '''Selective Search
 
     Parameters
@@ -248,6 +207,8 @@ def selective_search(
             Width of Gaussian kernel for felzenszwalb segmentation.
         min_size : int
             Minimum component size for felzenszwalb segmentation.
+        as_array : bool
+            Return the regions as a proposal array instead of dicts.
     Returns
     -------
         img : ndarray
@@ -262,6 +223,12 @@ def selective_search(
                 },
                 ...
             ]
+        or, if as_array, regions is the pair (proposals, sizes):
+        proposals : ndarray, (N, 5) float32
+            left, top, width, height and hierarchy level (1 for the last
+            region merged) of each region, see proposals
+        sizes : ndarray, (N,)
+            component size of each region
     '''
     assert im_orig.shape[2] == 3, "3ch image is expected"
 
@@ -270,53 +237,75 @@ def selective_search(
     img = _generate_segments(im_orig, scale, sigma, min_size)
 
     if img is None:
-        return None, {}
+        return None, proposals.no_proposals() if as_array else []
 
-    imsize = img.shape[0] * img.shape[1]
-    R = _extract_regions(img)
-
-    # extract neighbouring information
-    neighbours = _extract_neighbours(R)
+    R = _group_regions(img)
+    if as_array:
+        return img, proposals.table_proposals(R)
 
-    # calculate initial similarities
-    S = {}
-    for (ai, ar), (bi, br) in neighbours:
-        S[(ai, bi)] = _calc_sim(ar, br, imsize)
+    regions = R.regions()
 
-    # hierarchal search
-    while S != {}:
+    return img, regions
 
-        # get highest similarity
-        i, j = sorted(S.items(), key=lambda i: i[1])[-1][0]
 
-        # merge corresponding regions
-        t = max(R.keys()) + 1.0
-        R[t] = _merge_regions(R[i], R[j])
+def selective_search_diversified(
+        im_orig, colour_spaces=('hsv', 'lab'),
+        similarities=(SIMILARITIES, ('texture', 'size', 'fill')),
+        scales=(50, 100, 150, 300), sigma=0.8, min_size=50, n_workers=None, seed=0,
+        as_array=False):
+    '''Selective Search with diversification strategies
 
-        # mark similarities for regions to be removed
-        key_to_delete = []
-        for k, v in S.items():
-            if (i in k) or (j in k):
-                key_to_delete.append(k)
+    Runs selective_search for every combination of colour space, similarity
+    measures and scale in a pool of processes, and merges the hierarchies
+    by the pseudo-random rank of Uijlings et al., see diversify.
 
-        # remove old similarities of related regions
-        for k in key_to_delete:
-            del S[k]
+    Parameters
+    ----------
+        im_orig : ndarray
+            Input image
+        colour_spaces : tuple of str
+            Colour spaces of the colour histogram, from COLOUR_SPACES.
+        similarities : tuple of tuple of str
+            Similarity measures to combine, each from SIMILARITIES.
+        scales : tuple of int
+            Felzenszwalb scales (k) of the initial regions.
+        sigma : float
+            Width of Gaussian kernel for felzenszwalb segmentation.
+        min_size : int
+            Minimum component size for felzenszwalb segmentation.
+        n_workers : int
+            Worker processes, all cores by default.
+        seed : int
+            Seed of the random part of the rank.
+        as_array : bool
+            Return the regions as a proposal array instead of dicts.
+    Returns
+    -------
+        regions : array of dict, by increasing rank, without duplicate rects
+            [
+                {
+                    'rect': (left, top, width, height),
+                    'size': component_size,
+                    'rank': rank
+                },
+                ...
+            ]
+        or, if as_array, the pair (proposals, sizes) as selective_search
+        returns it, with the rank as the level of the proposals
+    '''
+    assert im_orig.shape[2] == 3, "3ch image is expected"
 
-        # calculate similarity set with the new region
-        for k in filter(lambda a: a != (i, j), key_to_delete):
-            n = k[1] if k[0] in (i, j) else k[0]
-            S[(t, n)] = _calc_sim(R[t], R[n], imsize)
+    strategies = [(im_orig, colour_space, tuple(sims), scale, sigma, min_size)
+                  for colour_space in colour_spaces
+                  for sims in similarities
+                  for scale in scales]
+    hierarchies = diversify.run_strategies(_run_strategy, strategies, n_workers)
+    rects, sizes, ranks, _ = diversify.rank_regions(hierarchies, seed)
+    if as_array:
+        return proposals.to_array(rects, ranks), sizes
 
     regions = []
-    for k, r in R.items():
-        regions.append({
-            'rect': (
-                r['min_x'], r['min_y'],
-                r['max_x'] - r['min_x'], r['max_y'] - r['min_y']),
-            'size': r['size'],
-            'labels': r['labels']
-        })
-
-    return img, regions
+    for rect, size, rank in zip(rects.tolist(), sizes.tolist(), ranks.tolist()):
+        regions.append({'rect': tuple(rect), 'size': size, 'rank': rank})
 
+    return regions